@@ -0,0 +1,94 @@
+from functools import lru_cache
+from pathlib import Path
+
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, field_validator
+
+from app.batch import BatchRunner, Lesson, build_story_teller, check_id
+from app.helper.env_helper import config
+from app.services.cache import Cache
+from app.services.ingestion import check_public_url
+from app.services.metrics import metrics
+from app.services.storyteller import StoryTeller
+
+app = FastAPI(title="LearnTales")
+
+# the batches of this process only, so the api has to run with a single worker
+batches: dict[str, BatchRunner] = {}
+
+
+def allowed_hosts() -> set[str] | None:
+    hosts = config.get("BATCH_URL_ALLOWLIST")
+    return {h.strip() for h in hosts.split(",") if h.strip()} if hosts else None
+
+
+class BatchRequest(BaseModel):
+    id: str | None = None
+    lessons: list[Lesson]
+    workers: int = 4
+
+    @field_validator("id")
+    @classmethod
+    def validate_id(cls, value: str | None) -> str | None:
+        return check_id(value)
+
+    @field_validator("lessons")
+    @classmethod
+    def validate_lessons(cls, lessons: list[Lesson]) -> list[Lesson]:
+        for lesson in lessons:
+            # files on the server are only read for manifests of the cli
+            if lesson.file is not None:
+                raise ValueError("lessons need content or a url instead of a file")
+            if lesson.url is not None:
+                check_public_url(lesson.url, allowed_hosts())
+        return lessons
+
+    def get_id(self) -> str:
+        # the same lessons map to the same folder, so a resubmitted batch resumes
+        if self.id:
+            return self.id
+        return Cache.make_key([lesson.get_id() for lesson in self.lessons])[:16]
+
+
+@lru_cache
+def get_story_teller() -> StoryTeller:
+    return build_story_teller(
+        api_key=config.get("NVIDIA_API_KEY", ""),
+        llm_rate=float(config.get("LLM_RATE_PER_SECOND", 1.0)),
+        vision_rate=float(config.get("VISION_RATE_PER_SECOND", 1.0)),
+        cache_path=config.get("CACHE_PATH"),
+        image_latency_budget=(
+            float(config["IMAGE_LATENCY_BUDGET_SECONDS"])
+            if "IMAGE_LATENCY_BUDGET_SECONDS" in config
+            else None
+        ),
+        public_urls_only=True,
+        allowed_hosts=allowed_hosts(),
+    )
+
+
+@app.post("/batches", status_code=202)
+def create_batch(request: BatchRequest, background_tasks: BackgroundTasks) -> dict:
+    batch_id = request.get_id()
+    running = batches.get(batch_id)
+    if running is not None and not running.finished():
+        raise HTTPException(status_code=409, detail=f"batch {batch_id} is running")
+    output_dir = Path(config.get("BATCH_OUTPUT_DIR", "output")) / batch_id
+    runner = BatchRunner(get_story_teller(), str(output_dir), workers=request.workers)
+    runner.progress["total"] = len(request.lessons)
+    batches[batch_id] = runner
+    background_tasks.add_task(runner.run, request.lessons)
+    return {"id": batch_id, "output_dir": str(output_dir)}
+
+
+@app.get("/batches/{batch_id}")
+def get_batch(batch_id: str) -> dict:
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail=f"batch {batch_id} not found")
+    return {"id": batch_id, **batches[batch_id].progress}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> str:
+    return metrics.render()
@@ -0,0 +1,270 @@
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterator
+
+from langchain_core.messages import BaseMessage
+from loguru import logger
+from pydantic import BaseModel, field_validator
+
+from app.helper.env_helper import config
+from app.helper.rate_limit import RateLimiter
+from app.services.cache import Cache
+from app.services.image_scheduler import ImageScheduler
+from app.services.ingestion import WebIngestor
+from app.services.llm import BaseChatModel, NvidiaFoundationChatModel, OllamaChatModel
+from app.services.storyteller import StoryTeller
+from app.services.vision_model import NvidiaFoundationVisionModel, VisualModel
+
+# ids name folders below the output dir, so they must not contain any path parts
+ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+
+
+def check_id(value: str | None) -> str | None:
+    if value is not None and not ID_PATTERN.match(value):
+        raise ValueError(f"{value!r} is not a valid id")
+    return value
+
+
+class Lesson(BaseModel):
+    id: str | None = None
+    content: str | None = None
+    file: str | None = None
+    url: str | None = None
+    from_year: int = 5
+    to_year: int = 7
+    language: str = "german"
+    model: str = "meta/llama3-70b-instruct"
+    audience: str = "children"
+
+    @field_validator("id")
+    @classmethod
+    def validate_id(cls, value: str | None) -> str | None:
+        return check_id(value)
+
+    def get_id(self) -> str:
+        if self.id:
+            return self.id
+        return Cache.make_key(
+            self.content,
+            self.file,
+            self.url,
+            self.from_year,
+            self.to_year,
+            self.language,
+            self.model,
+            self.audience,
+        )[:16]
+
+    def load_content(self, story_teller: StoryTeller) -> str:
+        if self.content:
+            return self.content
+        if self.file:
+            return Path(self.file).read_text()
+        if self.url:
+            return story_teller.load_from_website([self.url])
+        raise ValueError(f"lesson {self.get_id()} has neither content, file nor url")
+
+
+class RateLimitedChatModel(BaseChatModel):
+    def __init__(self, llm: BaseChatModel, rate_limiter: RateLimiter):
+        super().__init__(llm.name[0], api_key=llm.api_key)
+        self.llm = llm
+        self.rate_limiter = rate_limiter
+
+    def get_available_models(self):
+        return self.llm.get_available_models()
+
+    def get_context_window(self, model_name: str) -> int:
+        return self.llm.get_context_window(model_name)
+
+    def invoke(self, model_name: str, prompt: str, labels: dict = None) -> BaseMessage:
+        self.rate_limiter.acquire()
+        return self.llm.invoke(model_name=model_name, prompt=prompt, labels=labels)
+
+    def stream(
+        self, model_name: str, prompt: str, labels: dict = None
+    ) -> Iterator[str]:
+        self.rate_limiter.acquire()
+        yield from self.llm.stream(model_name=model_name, prompt=prompt, labels=labels)
+
+
+class RateLimitedVisualModel(VisualModel):
+    def __init__(self, vision_model: VisualModel, rate_limiter: RateLimiter):
+        super().__init__("Rate limited")
+        self.vision_model = vision_model
+        self.rate_limiter = rate_limiter
+
+    def generate_images(
+        self, prompts: list[str], iterations: int = 1
+    ) -> dict[str, str]:
+        for _ in prompts:
+            self.rate_limiter.acquire()
+        return self.vision_model.generate_images(prompts, iterations=iterations)
+
+
+def load_manifest(path: str) -> list[Lesson]:
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = [
+                {k: v for k, v in row.items() if v not in (None, "")}
+                for row in csv.DictReader(f)
+            ]
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [Lesson(**row) for row in rows]
+
+
+class BatchRunner:
+    def __init__(self, story_teller: StoryTeller, output_dir: str, workers: int = 4):
+        self.story_teller = story_teller
+        self.output_dir = Path(output_dir)
+        self.workers = workers
+        self.checkpoint_path = self.output_dir / "checkpoint.jsonl"
+        self.progress = {"total": 0, "done": 0, "failed": 0, "skipped": 0}
+        self._lock = threading.Lock()
+
+    def completed_ids(self) -> set[str]:
+        if not self.checkpoint_path.exists():
+            return set()
+        with open(self.checkpoint_path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return {r["id"] for r in records if r["status"] == "done"}
+
+    def finished(self) -> bool:
+        progress = self.progress
+        return progress["done"] + progress["failed"] + progress["skipped"] >= (
+            progress["total"]
+        )
+
+    def run(self, lessons: list[Lesson]) -> dict[str, int]:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        completed = self.completed_ids()
+        pending = [lesson for lesson in lessons if lesson.get_id() not in completed]
+        self.progress = {
+            "total": len(lessons),
+            "done": 0,
+            "failed": 0,
+            "skipped": len(lessons) - len(pending),
+        }
+        logger.info(
+            f"running {len(pending)} lessons, {self.progress['skipped']} already done"
+        )
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="batch"
+        ) as executor:
+            futures = {
+                executor.submit(self._tell, lesson): lesson for lesson in pending
+            }
+            for future in as_completed(futures):
+                lesson_id = futures[future].get_id()
+                try:
+                    future.result()
+                    self._checkpoint({"id": lesson_id, "status": "done"})
+                    self.progress["done"] += 1
+                except Exception as e:
+                    logger.opt(exception=e).error(f"lesson {lesson_id} failed")
+                    self._checkpoint(
+                        {"id": lesson_id, "status": "failed", "error": str(e)}
+                    )
+                    self.progress["failed"] += 1
+        return self.progress
+
+    def _tell(self, lesson: Lesson):
+        lesson_dir = self.output_dir / lesson.get_id()
+        if not lesson_dir.resolve().is_relative_to(self.output_dir.resolve()):
+            raise ValueError(f"lesson {lesson.get_id()} is outside the output dir")
+        lesson_dir.mkdir(parents=True, exist_ok=True)
+        story = self.story_teller.tell(
+            original_content=lesson.load_content(self.story_teller),
+            model_name=lesson.model,
+            audience=lesson.audience,
+            from_year=lesson.from_year,
+            to_year=lesson.to_year,
+            language=lesson.language,
+            output_folder_path=str(lesson_dir),
+        )
+        # write to a temporary file first so a crash never leaves half a story
+        tmp_path = lesson_dir / "story.html.tmp"
+        tmp_path.write_text(story)
+        tmp_path.replace(lesson_dir / "story.html")
+
+    def _checkpoint(self, record: dict):
+        with self._lock:
+            with open(self.checkpoint_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def build_story_teller(
+    api_key: str,
+    debug: bool = False,
+    llm_rate: float = 1.0,
+    vision_rate: float = 1.0,
+    cache_path: str | None = None,
+    image_latency_budget: float | None = None,
+    public_urls_only: bool = False,
+    allowed_hosts: set[str] | None = None,
+) -> StoryTeller:
+    cache = Cache(path=cache_path) if cache_path else None
+    llm = OllamaChatModel() if debug else NvidiaFoundationChatModel(api_key=api_key)
+    vision_model = NvidiaFoundationVisionModel(api_key=api_key, cache=cache)
+    return StoryTeller(
+        llm=RateLimitedChatModel(
+            llm, RateLimiter(llm_rate, burst=max(1, int(llm_rate)))
+        ),
+        visionModel=ImageScheduler(
+            RateLimitedVisualModel(
+                vision_model, RateLimiter(vision_rate, burst=max(1, int(vision_rate)))
+            ),
+            latency_budget=image_latency_budget,
+        ),
+        cache=cache,
+        ingestor=WebIngestor(
+            cache=cache, public_only=public_urls_only, allowed_hosts=allowed_hosts
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate stories for a manifest")
+    parser.add_argument("manifest", help="JSONL or CSV file with one lesson per row")
+    parser.add_argument("--output-dir", default="output")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--llm-rate", type=float, default=1.0, help="LLM requests per second"
+    )
+    parser.add_argument(
+        "--vision-rate", type=float, default=1.0, help="image requests per second"
+    )
+    parser.add_argument("--cache-path", default=config.get("CACHE_PATH"))
+    parser.add_argument(
+        "--image-budget",
+        type=float,
+        default=None,
+        help="seconds per image request, picks the quality tier (default: final)",
+    )
+    parser.add_argument("--debug", action="store_true", help="use Ollama")
+    args = parser.parse_args()
+
+    story_teller = build_story_teller(
+        api_key=config.get("NVIDIA_API_KEY", ""),
+        debug=args.debug,
+        llm_rate=args.llm_rate,
+        vision_rate=args.vision_rate,
+        cache_path=args.cache_path,
+        image_latency_budget=args.image_budget,
+    )
+    runner = BatchRunner(story_teller, args.output_dir, workers=args.workers)
+    progress = runner.run(load_manifest(args.manifest))
+    print(json.dumps(progress))
+
+
+if __name__ == "__main__":
+    main()
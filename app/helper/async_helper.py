@@ -0,0 +1,13 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_sync(coroutine):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # we are called from inside an event loop (e.g. fastapi), so the coroutine
+    # gets its own loop on a helper thread instead of blocking the running one
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,80 @@
+import html
+import threading
+from html.parser import HTMLParser
+
+ALLOWED_TAGS = {
+    "p", "br", "hr", "strong", "b", "em", "i", "u", "ul", "ol", "li",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "code", "pre", "a",
+}  # fmt: skip
+VOID_TAGS = {"br", "hr"}
+DROPPED_TAGS = {"script", "style", "iframe", "object", "embed", "head", "title"}
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.open_tags: list[str] = []
+        self.dropped = 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if tag in DROPPED_TAGS:
+            self.dropped += 1
+            return
+        if self.dropped > 0 or tag not in ALLOWED_TAGS:
+            return
+        attributes = ""
+        if tag == "a":
+            href = dict(attrs).get("href") or ""
+            if href.startswith(("http://", "https://")):
+                attributes = f' href="{html.escape(href)}"'
+        self.parts.append(f"<{tag}{attributes}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if tag not in DROPPED_TAGS:
+            self.handle_starttag(tag, attrs)
+            if tag in self.open_tags and tag not in VOID_TAGS:
+                self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+        if tag in DROPPED_TAGS:
+            self.dropped = max(0, self.dropped - 1)
+            return
+        if self.dropped > 0 or tag not in self.open_tags:
+            return
+        # close everything that was left open inside this tag
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data: str):
+        if self.dropped == 0:
+            self.parts.append(html.escape(data, quote=False))
+
+    def close(self) -> str:
+        super().close()
+        while self.open_tags:
+            self.parts.append(f"</{self.open_tags.pop()}>")
+        return "".join(self.parts)
+
+
+def sanitize_html(content: str) -> str:
+    sanitizer = _Sanitizer()
+    sanitizer.feed(content)
+    return sanitizer.close()
+
+
+_local = threading.local()
+
+
+def markdown_to_html(content: str) -> str:
+    # a Markdown instance is not thread-safe but expensive to set up
+    if not hasattr(_local, "markdown"):
+        import markdown
+
+        _local.markdown = markdown.Markdown()
+    return sanitize_html(_local.markdown.reset().convert(content))
@@ -0,0 +1,26 @@
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated_at) * self.rate_per_second,
+                )
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate_per_second
+            time.sleep(wait)
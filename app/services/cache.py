@@ -0,0 +1,139 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from loguru import logger
+
+
+class Cache:
+    def __init__(
+        self,
+        path: str,
+        max_size_bytes: int = 512 * 1024 * 1024,
+        ttl: float | None = 30 * 24 * 60 * 60,
+    ):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.ttl = ttl
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        serialized = json.dumps(parts, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, namespace: str, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is not None and self._is_expired(row[1], now):
+                self._connection.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses[namespace] += 1
+                return None
+            self._connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+            self._connection.commit()
+            self.hits[namespace] += 1
+        logger.debug(f"cache hit for {namespace}/{key}")
+        return row[0]
+
+    def set(self, namespace: str, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_size_bytes:
+            logger.warning(f"{namespace}/{key} exceeds the cache size and is skipped")
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, size, now, now),
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace"
+            ).fetchall()
+        entries = {namespace: (count, size) for namespace, count, size in rows}
+        namespaces = set(entries) | set(self.hits) | set(self.misses)
+        return {
+            namespace: {
+                "hits": self.hits[namespace],
+                "misses": self.misses[namespace],
+                "entries": entries.get(namespace, (0, 0))[0],
+                "size_bytes": entries.get(namespace, (0, 0))[1],
+            }
+            for namespace in sorted(namespaces)
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM entries")
+            self._connection.commit()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._connection.execute(
+                "DELETE FROM entries WHERE created_at < ?", (now - self.ttl,)
+            )
+        total_size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        rows = self._connection.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY accessed_at"
+        )
+        evicted = []
+        for namespace, key, size in rows:
+            if total_size <= self.max_size_bytes:
+                break
+            evicted.append((namespace, key))
+            total_size -= size
+        self._connection.executemany(
+            "DELETE FROM entries WHERE namespace = ? AND key = ?", evicted
+        )
+        logger.debug(f"evicted {len(evicted)} least recently used cache entries")
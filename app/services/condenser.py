@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from loguru import logger
+
+from app.services.cache import Cache
+from app.services.llm import BaseChatModel
+from app.services.prompt_budget import SEPARATORS, count_tokens
+
+
+class DocumentCondenser:
+
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        max_concurrency: int = 4,
+        chunk_tokens: int = 1000,
+        summary_tokens: int = 250,
+        reduce_tokens: int = 2000,
+        brief_tokens: int = 1500,
+        max_depth: int = 4,
+        encoding: str = "cl100k_base",
+        cache: Cache | None = None,
+        token_counter: Callable[[str], int] | None = None,
+    ):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.chunk_tokens = chunk_tokens
+        self.summary_tokens = summary_tokens
+        self.reduce_tokens = reduce_tokens
+        self.brief_tokens = brief_tokens
+        self.max_depth = max_depth
+        self.encoding = encoding
+        # without a persistent cache the summaries are still memoized per process
+        self.cache = cache if cache is not None else Cache(path=":memory:")
+        self._token_counter = token_counter
+
+    @staticmethod
+    def get_summary_context(max_tokens: int) -> str:
+        return f"""
+           Summarize the following text within the single hash marks in at most {max_tokens} tokens.
+           Keep every fact, name, date and number that a teacher would need to explain the topic.
+           Write the summary in the language of the text and return only the summary.
+        """
+
+    def count_tokens(self, text: str) -> int:
+        if self._token_counter is not None:
+            return self._token_counter(text)
+        return count_tokens(text, self.encoding)
+
+    def needs_condensing(self, content: str, max_tokens: int | None = None) -> bool:
+        max_tokens = max_tokens if max_tokens is not None else self.brief_tokens
+        return self.count_tokens(content) > max_tokens
+
+    def split(self, content: str) -> list[str]:
+        # only long documents are split, so the import waits until one arrives
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        # text without blank lines falls back to lines, sentences, words and
+        # finally characters, so no chunk exceeds chunk_tokens
+        text_splitter = RecursiveCharacterTextSplitter(
+            separators=SEPARATORS + [""],
+            chunk_size=self.chunk_tokens,
+            chunk_overlap=0,
+            length_function=self.count_tokens,
+        )
+        return text_splitter.split_text(content)
+
+    def condense_text(
+        self, content: str, model_name: str, max_tokens: int | None = None
+    ) -> str:
+        if not self.needs_condensing(content, max_tokens):
+            return content
+        return self.condense(self.split(content), model_name, max_tokens)
+
+    def condense(
+        self, chunks: list[str], model_name: str, max_tokens: int | None = None
+    ) -> str:
+        max_tokens = max_tokens if max_tokens is not None else self.brief_tokens
+        logger.info(f"condensing {len(chunks)} chunks with {model_name}")
+        summaries = self._summarize_all(chunks, model_name)
+        for depth in range(self.max_depth):
+            if len(summaries) <= 1 or self._total_tokens(summaries) <= max_tokens:
+                break
+            groups = self._group(summaries)
+            logger.debug(f"reducing {len(summaries)} summaries at depth {depth + 1}")
+            summaries = self._summarize_all(
+                ["\n\n".join(group) for group in groups], model_name
+            )
+        return "\n\n".join(summaries)
+
+    def _summarize_all(self, texts: list[str], model_name: str) -> list[str]:
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="condenser"
+        ) as executor:
+            return list(executor.map(lambda t: self._summarize(t, model_name), texts))
+
+    def _summarize(self, text: str, model_name: str) -> str:
+        context = self.get_summary_context(self.summary_tokens)
+        key = Cache.make_key(model_name, context, text)
+        summary = self.cache.get("summary", key)
+        if summary is None:
+            result = self.llm.invoke(model_name=model_name, prompt=f"{context}#{text}#")
+            summary = result.content
+            self.cache.set("summary", key, summary)
+        return summary
+
+    def _group(self, summaries: list[str]) -> list[list[str]]:
+        groups = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            tokens = self.count_tokens(summary)
+            if groups[-1] and group_tokens + tokens > self.reduce_tokens:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += tokens
+        if len(groups) == len(summaries) and len(groups) > 1:
+            # every summary exceeds the reduce budget on its own, so pairs are
+            # merged anyway to make sure the hierarchy gets smaller
+            groups = [summaries[i : i + 2] for i in range(0, len(summaries), 2)]
+        return groups
+
+    def _total_tokens(self, summaries: list[str]) -> int:
+        return sum(self.count_tokens(s) for s in summaries)
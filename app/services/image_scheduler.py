@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, List, NamedTuple
+
+from loguru import logger
+
+from app.services.metrics import metrics
+from app.services.placeholders import normalize_prompt, select_prompts
+from app.services.vision_model import VisualModel
+
+
+class QualityTier(NamedTuple):
+    name: str
+    steps: int
+    # expected seconds per request until the first one was measured
+    seconds: float
+
+
+QUALITY_TIERS = [
+    QualityTier("preview", steps=1, seconds=2.0),
+    QualityTier("standard", steps=4, seconds=5.0),
+    QualityTier("final", steps=8, seconds=10.0),
+]
+
+
+class ImageScheduler(VisualModel):
+    def __init__(
+        self,
+        vision_model: VisualModel,
+        tiers: List[QualityTier] = QUALITY_TIERS,
+        latency_budget: float | None = None,
+        refine: bool = False,
+        max_batch_size: int | None = None,
+        max_workers: int = 2,
+        refine_workers: int = 1,
+        max_refined: int = 256,
+        alpha: float = 0.2,
+        probe_every: int = 20,
+    ):
+        super().__init__("Image scheduler")
+        self.vision_model = vision_model
+        self.tiers = sorted(tiers, key=lambda t: t.steps)
+        self.latency_budget = latency_budget
+        self.refine = refine
+        self.max_batch_size = (
+            max_batch_size
+            if max_batch_size is not None
+            else vision_model.max_batch_size
+        )
+        self.max_refined = max_refined
+        self.alpha = alpha
+        self.probe_every = probe_every
+        self._latency = {tier.name: tier.seconds for tier in self.tiers}
+        self._requests = 0
+        self._refined: OrderedDict[str, str] = OrderedDict()
+        self._refining: dict[str, list[tuple[str, Callable[[str, str], None]]]] = {}
+        self._futures: set[Future] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-scheduler"
+        )
+        # refinement has its own workers, so it never delays a story's previews
+        self._refine_executor = ThreadPoolExecutor(
+            max_workers=refine_workers, thread_name_prefix="image-refine"
+        )
+
+    def choose_tier(self, latency_budget: float | None = None) -> QualityTier:
+        budget = latency_budget if latency_budget is not None else self.latency_budget
+        if budget is None:
+            return self.tiers[-1]
+        fitting = [t for t in self.tiers if self._latency[t.name] <= budget]
+        return fitting[-1] if len(fitting) > 0 else self.tiers[0]
+
+    def generate_images(
+        self,
+        prompts: list[str],
+        iterations: int | None = None,
+        on_refined: Callable[[str, str], None] | None = None,
+    ) -> dict[str, str]:
+        tier = self._probe(self.choose_tier())
+        if iterations is not None:
+            tier = QualityTier("custom", steps=iterations, seconds=0.0)
+        selected = select_prompts(prompts)
+        images = {}
+        missing = []
+        with self._lock:
+            for prompt in dict.fromkeys(selected.values()):
+                refined = self._refined.get(normalize_prompt(prompt))
+                if refined is not None:
+                    self._refined.move_to_end(normalize_prompt(prompt))
+                    images[prompt] = refined
+                else:
+                    missing.append(prompt)
+        if len(missing) > 0:
+            images.update(self._generate(missing, tier))
+            if self.refine and tier.steps < self.tiers[-1].steps:
+                for prompt in missing:
+                    if prompt in images:
+                        self._refine_later(prompt, on_refined)
+        return {p: images[rep] for p, rep in selected.items() if rep in images}
+
+    def warm_up(self, iterations: int | None = None):
+        self.vision_model.warm_up(
+            iterations if iterations is not None else self.choose_tier().steps
+        )
+
+    def wait(self, timeout: float | None = None) -> bool:
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = wait(futures, timeout=timeout)
+        return len(not_done) == 0
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._refine_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _probe(self, tier: QualityTier) -> QualityTier:
+        # the latency of a tier is only measured while it is used, so the next
+        # better tier is tried now and then to notice when it fits again
+        with self._lock:
+            self._requests += 1
+            probe = self.probe_every > 0 and self._requests % self.probe_every == 0
+        index = self.tiers.index(tier)
+        if probe and index + 1 < len(self.tiers):
+            logger.debug(f"probing the {self.tiers[index + 1].name} tier")
+            return self.tiers[index + 1]
+        return tier
+
+    def _generate(self, prompts: list[str], tier: QualityTier) -> dict[str, str]:
+        size = self.max_batch_size if self.max_batch_size else len(prompts)
+        batches = [prompts[i : i + size] for i in range(0, len(prompts), size)]
+        logger.debug(
+            f"generating {len(prompts)} images in {len(batches)} batches "
+            f"with the {tier.name} tier"
+        )
+        images = {}
+        if len(batches) == 1:
+            images.update(self._generate_batch(batches[0], tier))
+        else:
+            # the batches run side by side, the backend limits its own concurrency
+            for result in self._executor.map(
+                lambda b: self._generate_batch(b, tier), batches
+            ):
+                images.update(result)
+        return images
+
+    def _generate_batch(self, prompts: list[str], tier: QualityTier) -> dict[str, str]:
+        start = time.perf_counter()
+        images = self.vision_model.generate_images(prompts, tier.steps)
+        # each request is measured on its own, not the wall time of all batches
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if tier.name in self._latency:
+                self._latency[tier.name] = (
+                    self.alpha * elapsed + (1 - self.alpha) * self._latency[tier.name]
+                )
+        metrics.observe("image_batch_seconds", elapsed, tier=tier.name)
+        return images
+
+    def _refine_later(self, prompt: str, on_refined: Callable[[str, str], None] | None):
+        key = normalize_prompt(prompt)
+        with self._lock:
+            callbacks = self._refining.get(key)
+            if callbacks is not None:
+                # the prompt is already refined for another story
+                if on_refined is not None:
+                    callbacks.append((prompt, on_refined))
+                return
+            self._refining[key] = (
+                [(prompt, on_refined)] if on_refined is not None else []
+            )
+        future = self._refine_executor.submit(self._refine, key, prompt)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _refine(self, key: str, prompt: str):
+        image = None
+        try:
+            image = self._generate([prompt], self.tiers[-1]).get(prompt)
+        except Exception as e:
+            logger.error(f"failed to refine the image for {prompt}: {e}")
+        with self._lock:
+            callbacks = self._refining.pop(key)
+            if image is not None:
+                self._refined[key] = image
+                while len(self._refined) > self.max_refined:
+                    self._refined.popitem(last=False)
+        if image is None:
+            return
+        for callback_prompt, callback in callbacks:
+            try:
+                callback(callback_prompt, image)
+            except Exception as e:
+                logger.error(f"failed to store the refined image for {prompt}: {e}")
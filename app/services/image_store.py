@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import io
+import tempfile
+import threading
+from pathlib import Path
+
+from loguru import logger
+
+
+class ImageStore:
+    def __init__(
+        self,
+        directory: str,
+        url_prefix: str = "app/static/images",
+        target_width: int | None = 300,
+        quality: int = 80,
+        max_size_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.target_width = target_width
+        self.quality = quality
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+
+    def put(self, base64_image: str) -> str:
+        data = base64.b64decode(base64_image)
+        image_id = hashlib.sha256(data).hexdigest()[:32]
+        path = self.path(image_id)
+        if path.exists():
+            # touch it so it counts as recently used for the eviction
+            path.touch()
+            return image_id
+        data = self._downscale(data)
+        # concurrent writers of the same image each use their own temporary file
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as tmp_file:
+            tmp_file.write(data)
+        Path(tmp_file.name).replace(path)
+        self._evict(keep=path)
+        return image_id
+
+    def get(self, image_id: str) -> bytes | None:
+        path = self.path(image_id)
+        return path.read_bytes() if path.exists() else None
+
+    def path(self, image_id: str) -> Path:
+        return self.directory / f"{image_id}.jpg"
+
+    def url(self, image_id: str) -> str:
+        return f"{self.url_prefix}/{image_id}.jpg"
+
+    def _downscale(self, data: bytes) -> bytes:
+        if self.target_width is None:
+            return data
+        try:
+            from PIL import Image
+        except ImportError:
+            logger.warning("pillow is not installed, images are stored unscaled")
+            return data
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if image.width > self.target_width:
+                    height = round(image.height * self.target_width / image.width)
+                    image = image.resize((self.target_width, height))
+                output = io.BytesIO()
+                image.convert("RGB").save(
+                    output, format="JPEG", quality=self.quality, optimize=True
+                )
+        except Exception as e:
+            logger.error(f"failed to downscale image due to {e}")
+            return data
+        return output.getvalue() if output.tell() < len(data) else data
+
+    def _evict(self, keep: Path):
+        with self._lock:
+            files = sorted(
+                (p.stat().st_mtime, p.stat().st_size, p)
+                for p in self.directory.glob("*.jpg")
+            )
+            total_size = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total_size <= self.max_size_bytes:
+                    break
+                if path == keep:
+                    continue
+                path.unlink(missing_ok=True)
+                total_size -= size
@@ -0,0 +1,139 @@
+import io
+import ipaddress
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from typing import Callable, List
+from urllib.parse import urljoin, urlparse
+
+from loguru import logger
+
+from app.services.cache import Cache
+from app.services.llm import keep_alive_session
+
+
+HTML_CONTENT_TYPES = {"text/html", "application/xhtml+xml"}
+
+
+def parse_html(html: str) -> str:
+    # unstructured is slow to import, so it is only loaded once a page is parsed
+    from unstructured.partition.html import partition_html
+
+    return "\n\n".join(str(element) for element in partition_html(text=html))
+
+
+def parse_document(content: bytes, content_type: str | None = None) -> str:
+    header = Message()
+    header["Content-Type"] = content_type or "text/html"
+    mime_type = header.get_content_type()
+    charset = header.get_content_charset() or "utf-8"
+    if mime_type in HTML_CONTENT_TYPES:
+        return parse_html(content.decode(charset, errors="replace"))
+    if mime_type == "text/plain":
+        return content.decode(charset, errors="replace")
+    # pdf, docx and the other formats are detected by unstructured
+    from unstructured.partition.auto import partition
+
+    elements = partition(file=io.BytesIO(content), content_type=mime_type)
+    return "\n\n".join(str(element) for element in elements)
+
+
+def check_public_url(url: str, allowed_hosts: set[str] | None = None):
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"{url} is not an http(s) url")
+    if allowed_hosts is not None and parsed.hostname not in allowed_hosts:
+        raise ValueError(f"{parsed.hostname} is not an allowed host")
+    # every address of the host has to be public, so no internal service is reached
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 443)
+    except OSError:
+        raise ValueError(f"{parsed.hostname} cannot be resolved")
+    for *_, address in addresses:
+        if not ipaddress.ip_address(address[0]).is_global:
+            raise ValueError(f"{parsed.hostname} resolves to a private address")
+
+
+class WebIngestor:
+    def __init__(
+        self,
+        cache: Cache | None = None,
+        max_concurrency: int = 8,
+        timeout: float = 10,
+        parser: Callable[[bytes, str | None], str] = parse_document,
+        public_only: bool = False,
+        allowed_hosts: set[str] | None = None,
+        max_redirects: int = 5,
+    ):
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.parser = parser
+        self.public_only = public_only
+        self.allowed_hosts = allowed_hosts
+        self.max_redirects = max_redirects
+        self._session = keep_alive_session(pool_maxsize=max_concurrency)
+
+    def load(self, urls: List[str]) -> List[str]:
+        if len(urls) == 0:
+            return []
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(urls)),
+            thread_name_prefix="ingestion",
+        ) as executor:
+            documents = list(executor.map(self._load_or_none, urls))
+        return [d for d in documents if d is not None]
+
+    def load_text(self, urls: List[str]) -> str:
+        return "\n\n".join(d for d in self.load(urls) if len(d) > 0)
+
+    def fetch(self, url: str) -> str:
+        key = Cache.make_key(url)
+        cached = self.cache.get("page", key) if self.cache is not None else None
+        cached = json.loads(cached) if cached is not None else None
+
+        headers = {}
+        if cached is not None and cached.get("etag") is not None:
+            headers["If-None-Match"] = cached["etag"]
+        if cached is not None and cached.get("last_modified") is not None:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        response = self._get(url, headers)
+        if response.status_code == 304 and cached is not None:
+            logger.debug(f"{url} is not modified, using the cached content")
+            return cached["content"]
+        response.raise_for_status()
+
+        content = self.parser(response.content, response.headers.get("Content-Type"))
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if self.cache is not None and (etag is not None or last_modified is not None):
+            self.cache.set(
+                "page",
+                key,
+                json.dumps(
+                    {"etag": etag, "last_modified": last_modified, "content": content}
+                ),
+            )
+        return content
+
+    def _get(self, url: str, headers: dict):
+        if not self.public_only:
+            return self._session.get(url, headers=headers, timeout=self.timeout)
+        # redirects are followed by hand, so each target is checked as well
+        for _ in range(self.max_redirects + 1):
+            check_public_url(url, self.allowed_hosts)
+            response = self._session.get(
+                url, headers=headers, timeout=self.timeout, allow_redirects=False
+            )
+            if not response.is_redirect:
+                return response
+            url = urljoin(url, response.headers["Location"])
+        raise ValueError(f"{url} redirects more than {self.max_redirects} times")
+
+    def _load_or_none(self, url: str) -> str | None:
+        try:
+            return self.fetch(url)
+        except Exception as e:
+            logger.error(f"failed to load {url} due to {e}")
+            return None
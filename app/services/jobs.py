@@ -0,0 +1,346 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from loguru import logger
+
+from app.services.storyteller import StoryTeller
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, key: str, backend: str, on_change: Callable | None = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.backend = backend
+        self.status = "queued"
+        self.progress = {"text": "", "images_done": 0, "images_total": 0}
+        self.result: str | None = None
+        self.error: str | None = None
+        self.created_at = time.time()
+        # sessions waiting for the job, it is only cancelled once all left
+        self.subscribers = 1
+        self._on_change = on_change
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"job {self.id} was cancelled")
+
+    def update(self, **progress):
+        self.progress.update(progress)
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def wait(self, timeout: float | None = None) -> str | None:
+        self._finished.wait(timeout)
+        return self.result
+
+    def finish(self, status: str, result: str | None = None, error: str | None = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self._finished.set()
+        if self._on_change is not None:
+            self._on_change(self, force=True)
+
+    def is_finished(self) -> bool:
+        return self._finished.is_set()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "key": self.key,
+            "backend": self.backend,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+        }
+
+
+class RedisJobStore:
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "learntales:jobs",
+        ttl: int = 60 * 60,
+        claim_ttl: int = 30,
+        client=None,
+    ):
+        if client is None:
+            if redis is None:
+                raise ImportError("redis is not installed, run pip install redis")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+
+    def claim(self, key: str, job_id: str) -> str | None:
+        # the first process that claims a key runs the job, all others follow it;
+        # the claim expires soon unless its owner keeps refreshing it
+        if self.client.set(
+            f"{self.prefix}:key:{key}", job_id, nx=True, ex=self.claim_ttl
+        ):
+            return None
+        claimed_by = self.owner(key)
+        if claimed_by is None:
+            return self.claim(key, job_id)
+        return claimed_by
+
+    def owner(self, key: str) -> str | None:
+        claimed_by = self.client.get(f"{self.prefix}:key:{key}")
+        return claimed_by.decode() if isinstance(claimed_by, bytes) else claimed_by
+
+    def refresh(self, key: str, job_id: str):
+        if self.owner(key) == job_id:
+            self.client.expire(f"{self.prefix}:key:{key}", self.claim_ttl)
+
+    def release(self, key: str, job_id: str):
+        if self.owner(key) == job_id:
+            self.client.delete(f"{self.prefix}:key:{key}")
+
+    def subscribe(self, job_id: str) -> int:
+        subscribers = self.client.incr(f"{self.prefix}:subscribers:{job_id}")
+        self.client.expire(f"{self.prefix}:subscribers:{job_id}", self.ttl)
+        return subscribers
+
+    def unsubscribe(self, job_id: str) -> int:
+        return self.client.decr(f"{self.prefix}:subscribers:{job_id}")
+
+    def request_cancel(self, job_id: str):
+        self.client.set(f"{self.prefix}:cancel:{job_id}", "1", ex=self.ttl)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        return self.client.get(f"{self.prefix}:cancel:{job_id}") is not None
+
+    def save(self, job: dict):
+        self.client.set(f"{self.prefix}:job:{job['id']}", json.dumps(job), ex=self.ttl)
+
+    def load(self, job_id: str) -> dict | None:
+        value = self.client.get(f"{self.prefix}:job:{job_id}")
+        return json.loads(value) if value is not None else None
+
+
+class JobQueue:
+    def __init__(
+        self,
+        workers: int = 4,
+        limits: dict[str, int] | None = None,
+        store: RedisJobStore | None = None,
+        max_jobs: int = 256,
+        save_interval: float = 0.25,
+    ):
+        self.workers = workers
+        self.limits = limits if limits is not None else {}
+        self.store = store
+        self.max_jobs = max_jobs
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._in_flight: dict[str, Job] = {}
+        self._queued: dict[str, deque] = defaultdict(deque)
+        self._running: dict[str, int] = defaultdict(int)
+        self._saved_at: dict[str, float] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="story-jobs"
+        )
+        self._stopped = threading.Event()
+        if store is not None:
+            threading.Thread(
+                target=self._heartbeat, name="story-jobs-heartbeat", daemon=True
+            ).start()
+
+    def submit(
+        self, key: str, fn: Callable[[Job], str], backend: str = "default"
+    ) -> str:
+        with self._lock:
+            if key in self._in_flight:
+                logger.debug(f"job {key} is already in flight")
+                job = self._in_flight[key]
+                job.subscribers += 1
+                if self.store is not None:
+                    self.store.subscribe(job.id)
+                return job.id
+            job = Job(key, backend, on_change=self._save)
+            if self.store is not None:
+                claimed_by = self.store.claim(key, job.id)
+                if claimed_by is not None:
+                    logger.debug(f"job {key} is already in flight as {claimed_by}")
+                    self.store.subscribe(claimed_by)
+                    return claimed_by
+                self.store.subscribe(job.id)
+            self._in_flight[key] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.is_finished():
+                    break
+                self._jobs.pop(oldest_id)
+            self._queued[backend].append((job, fn))
+        self._save(job, force=True)
+        self._dispatch(backend)
+        return job.id
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> dict | None:
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is None:
+            return None
+        status = self.store.load(job_id)
+        if (
+            status is not None
+            and status["status"] in ("queued", "running")
+            and self.store.owner(status["key"]) != job_id
+        ):
+            # the claim expired, so the process that ran the job is gone
+            return {**status, "status": "failed", "error": "the job was lost"}
+        return status
+
+    def cancel(self, job_id: str) -> bool:
+        # a session leaving a job only cancels it when no other one waits for it
+        job = self.get(job_id)
+        if job is not None and job.is_finished():
+            return False
+        if self.store is not None:
+            remaining = self.store.unsubscribe(job_id)
+        elif job is not None:
+            with self._lock:
+                job.subscribers -= 1
+                remaining = job.subscribers
+        else:
+            return False
+        if remaining > 0:
+            logger.debug(f"job {job_id} is still followed by {remaining} sessions")
+            return False
+        if job is None:
+            # the job runs in another process, which picks this up with its heartbeat
+            self.store.request_cancel(job_id)
+            return True
+        job.cancel()
+        # queued jobs are dropped by the dispatcher, running jobs stop at the
+        # next chunk
+        self._dispatch(job.backend)
+        return True
+
+    def shutdown(self, wait: bool = True):
+        self._stopped.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self.store.claim_ttl / 3):
+            with self._lock:
+                jobs = list(self._in_flight.values())
+            for job in jobs:
+                try:
+                    self.store.refresh(job.key, job.id)
+                    if self.store.is_cancel_requested(job.id):
+                        job.cancel()
+                        self._dispatch(job.backend)
+                except Exception as e:
+                    logger.warning(f"heartbeat of job {job.id} failed due to {e}")
+
+    def _dispatch(self, backend: str):
+        with self._lock:
+            limit = self.limits.get(backend, self.workers)
+            queued = self._queued[backend]
+            to_run, to_cancel = [], []
+            for job, fn in list(queued):
+                if job.cancelled:
+                    queued.remove((job, fn))
+                    to_cancel.append(job)
+            while queued and self._running[backend] < limit:
+                to_run.append(queued.popleft())
+                self._running[backend] += 1
+        for job in to_cancel:
+            self._complete(job, "cancelled")
+        for job, fn in to_run:
+            self._executor.submit(self._run, job, fn)
+
+    def _run(self, job: Job, fn: Callable[[Job], str]):
+        job.status = "running"
+        self._save(job, force=True)
+        try:
+            result = fn(job)
+            self._complete(job, "done", result=result)
+        except JobCancelled:
+            self._complete(job, "cancelled")
+        except Exception as e:
+            logger.opt(exception=e).error(f"job {job.id} failed")
+            self._complete(job, "failed", error=str(e))
+        finally:
+            with self._lock:
+                self._running[job.backend] -= 1
+            self._dispatch(job.backend)
+
+    def _complete(self, job: Job, status: str, **kwargs):
+        with self._lock:
+            if self._in_flight.get(job.key) is job:
+                self._in_flight.pop(job.key)
+        job.finish(status, **kwargs)
+        self._saved_at.pop(job.id, None)
+        if self.store is not None:
+            self.store.release(job.key, job.id)
+
+    def _save(self, job: Job, force: bool = False):
+        if self.store is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at.get(job.id, 0) < self.save_interval:
+            return
+        self._saved_at[job.id] = now
+        try:
+            self.store.save(job.to_dict())
+        except Exception as e:
+            logger.warning(f"progress of job {job.id} could not be saved due to {e}")
+
+
+def story_job(story_teller: StoryTeller, **story) -> Callable[[Job], str]:
+    def run(job: Job) -> str:
+        text = ""
+        stream = story_teller.tell_stream(
+            **story,
+            on_images=lambda done, total: job.update(
+                images_done=done, images_total=total
+            ),
+        )
+        try:
+            while True:
+                job.raise_if_cancelled()
+                text += next(stream)
+                job.update(text=text)
+        except StopIteration as stop:
+            if story_teller.last_trace is not None:
+                job.update(trace=story_teller.last_trace.to_dict())
+            return stop.value
+        finally:
+            stream.close()
+
+    return run
@@ -1,16 +1,93 @@
 import os
-from typing import List, Tuple
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Iterator, List, Tuple
 
-from langchain_community.llms.ollama import Ollama
+import requests
 from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import StrOutputParser, BaseTransformOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import Runnable
-from langchain_nvidia_ai_endpoints import ChatNVIDIA
 from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from app.services.prompt_budget import DEFAULT_CONTEXT_WINDOW
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timeout: float | None = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        # clients that don't pass a timeout still give up on a hanging request
+        timeout = timeout if timeout is not None else self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def keep_alive_session(
+    pool_maxsize: int = 10, timeout: float | None = None
+) -> requests.Session:
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, timeout=timeout
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ClientPool:
+    def __init__(
+        self, factory: Callable[[Hashable], Any], max_size: int = 4, max_keys: int = 8
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.max_keys = max_keys
+        self.created = 0
+        self._lock = threading.Lock()
+        self._idle: OrderedDict[Hashable, list] = OrderedDict()
+        self._slots: dict[Hashable, threading.BoundedSemaphore] = {}
+
+    @contextmanager
+    def acquire(self, key: Hashable):
+        with self._lock:
+            slots = self._slots.setdefault(
+                key, threading.BoundedSemaphore(self.max_size)
+            )
+        # blocks while max_size clients of this key are in use by other sessions
+        with slots:
+            client = self._checkout(key)
+            try:
+                yield client
+            finally:
+                self._checkin(key, client)
+
+    def _checkout(self, key: Hashable):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                return idle.pop()
+        logger.debug(f"creating new client for {key}")
+        client = self.factory(key)
+        with self._lock:
+            self.created += 1
+        return client
+
+    def _checkin(self, key: Hashable, client: Any):
+        with self._lock:
+            self._idle.setdefault(key, []).append(client)
+            self._idle.move_to_end(key)
+            while len(self._idle) > self.max_keys:
+                evicted_key, _ = self._idle.popitem(last=False)
+                logger.debug(f"dropping idle clients for {evicted_key}")
 
 
 class BaseChatModel:
+    context_windows: dict[str, int] = {}
+
     def __init__(self, name: str, api_key: str | None = None):
         self.name = (name,)
         self.api_key = api_key
@@ -18,15 +95,34 @@ class BaseChatModel:
     def is_api_key_needed(self) -> bool:
         return self.api_key is not None
 
+    def get_context_window(self, model_name: str) -> int:
+        # ollama tags like llama3:8b fall back to the model family
+        for name in (model_name, model_name.split(":")[0]):
+            if name in self.context_windows:
+                return self.context_windows[name]
+        return DEFAULT_CONTEXT_WINDOW
+
     def get_available_models(self) -> List[Tuple]:
         raise NotImplementedError
 
     def invoke(self, model_name: str, prompt: str, labels: dict = None) -> BaseMessage:
         raise NotImplementedError
 
+    def stream(
+        self, model_name: str, prompt: str, labels: dict = None
+    ) -> Iterator[str]:
+        raise NotImplementedError
+
     def _get_model(self, model_name: str) -> Runnable:
         raise NotImplementedError
 
+    def warm_up(self, model_name: str):
+        pass
+
+    def fell_back(self) -> bool:
+        # whether the last answer in this context came from a fallback backend
+        return False
+
     def chain(
         self,
         prompt: ChatPromptTemplate,
@@ -37,50 +133,102 @@ class BaseChatModel:
 
 
 class OllamaChatModel(BaseChatModel):
-    def __init__(self):
+    context_windows = {"llama3": 8192, "phi3": 4096, "gemma": 8192}
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:11434",
+        pool_size: int = 4,
+        timeout: float = 5,
+    ):
         super().__init__("Ollama")
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = keep_alive_session(pool_maxsize=1)
+        self._clients = ClientPool(self._build_client, pool_size)
 
-    def get_available_models(self) -> List[Tuple]:
-        llama3 = ("1", "llama3:latest", "")
-        phi3 = ("2", "phi3:medium", "")
-        gemma7b = ("3", "gemma:7b", "")
+    def _build_client(self, model_name: str) -> Runnable:
+        # langchain_community is slow to import and only needed once ollama is used
+        from langchain_community.llms.ollama import Ollama
+
+        return Ollama(model=model_name, base_url=self.base_url)
+
+    def warm_up(self, model_name: str):
+        with self._clients.acquire(model_name):
+            pass
 
-        return [llama3, phi3, gemma7b]
+    def get_available_models(self) -> List[Tuple]:
+        response = self._session.get(f"{self.base_url}/api/tags", timeout=self.timeout)
+        response.raise_for_status()
+        models = sorted(m["name"] for m in response.json().get("models", []))
+        return [(str(i + 1), name, "") for i, name in enumerate(models)]
 
     def invoke(self, model_name: str, prompt: str, labels=None) -> BaseMessage:
         if labels is None:
             labels = {}
-        llm = Ollama(model=model_name)
-        result = llm.invoke(prompt, labels=labels)
+        with self._clients.acquire(model_name) as llm:
+            result = llm.invoke(prompt, labels=labels)
         return BaseMessage(content=result, type="str")
 
+    def stream(self, model_name: str, prompt: str, labels=None) -> Iterator[str]:
+        if labels is None:
+            labels = {}
+        with self._clients.acquire(model_name) as llm:
+            for chunk in llm.stream(prompt, labels=labels):
+                yield chunk
+
 
 class NvidiaFoundationChatModel(BaseChatModel):
-    def __init__(self, api_key: str):
+    context_windows = {
+        "meta/llama3-70b-instruct": 8192,
+        "microsoft/phi-3-medium-4k-instruct": 4096,
+        "google/gemma-7b": 8192,
+    }
+
+    def __init__(self, api_key: str, base_url: str | None = None, pool_size: int = 4):
         super().__init__("Nvidia Foundation", api_key=api_key)
         os.environ["NVIDIA_API_KEY"] = api_key
+        self.base_url = base_url
+        self._session = keep_alive_session(pool_maxsize=pool_size)
+        self._clients = ClientPool(self._build_client, pool_size)
 
     def get_available_models(self) -> List[Tuple]:
-        try:
-            supported_models = [
-                "meta/llama3-70b-instruct",
-                "microsoft/phi-3-medium-4k-instruct",
-                "google/gemma-7b",
-            ]
-            models = ChatNVIDIA.get_available_models()
-            return [
-                (m.id, m.model_name, m.path)
-                for m in models
-                if m.model_name in supported_models
-            ]
-        except Exception as e:
-            logger.opt(exception=e).error("the models could not be loaded")
-            return []
+        from langchain_nvidia_ai_endpoints import ChatNVIDIA
+
+        models = ChatNVIDIA.get_available_models()
+        return [
+            (m.id, m.model_name, m.path)
+            for m in models
+            if m.model_name in self.context_windows
+        ]
+
+    def _build_client(self, model_name: str) -> Runnable:
+        from langchain_nvidia_ai_endpoints import ChatNVIDIA
+
+        if self.base_url is not None:
+            llm = ChatNVIDIA(model=model_name, base_url=self.base_url)
+        else:
+            llm = ChatNVIDIA(model=model_name)
+        # every client shares one keep-alive session instead of opening a new
+        # connection per request
+        llm.client.get_session_fn = lambda: self._session
+        return llm
 
     def _get_model(self, model_name: str) -> Runnable:
-        return ChatNVIDIA(model=model_name)
+        return self._build_client(model_name)
+
+    def warm_up(self, model_name: str):
+        with self._clients.acquire(model_name):
+            pass
 
     def invoke(self, model_name: str, prompt: str, labels: dict = None) -> BaseMessage:
-        llm = ChatNVIDIA(model=model_name)
-        result = llm.invoke(prompt)
+        with self._clients.acquire(model_name) as llm:
+            result = llm.invoke(prompt)
         return result
+
+    def stream(
+        self, model_name: str, prompt: str, labels: dict = None
+    ) -> Iterator[str]:
+        with self._clients.acquire(model_name) as llm:
+            for chunk in llm.stream(prompt):
+                yield chunk.content
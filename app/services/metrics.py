@@ -0,0 +1,174 @@
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from app.services.prompt_budget import get_encoding
+
+
+def count_tokens(text: str, encoding: str = "cl100k_base") -> int | None:
+    encoder = get_encoding(encoding)
+    if encoder is None:
+        return None
+    return len(encoder.encode_ordinary(text))
+
+
+class StoryTrace:
+    def __init__(self, model_name: str, encoding: str = "cl100k_base"):
+        self.id = uuid.uuid4().hex
+        self.model_name = model_name
+        self.encoding = encoding
+        self.stages: dict[str, float] = defaultdict(float)
+        self.tokens: dict[str, int] = {}
+        self.images = {"requested": 0, "generated": 0, "failed": 0}
+        self._started_at = time.perf_counter()
+        self.time_to_first_token: float | None = None
+        self.total_seconds = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.elapsed()
+
+    def count_tokens(self, kind: str, text: str):
+        tokens = count_tokens(text, self.encoding)
+        if tokens is not None:
+            self.tokens[kind] = self.tokens.get(kind, 0) + tokens
+
+    def count_images(self, requested: int, generated: int):
+        self.images["requested"] += requested
+        self.images["generated"] += generated
+        self.images["failed"] += requested - generated
+
+    def finish(self) -> "StoryTrace":
+        self.total_seconds = self.elapsed()
+        metrics.record(self)
+        logger.bind(trace=self.to_dict()).info(
+            f"story {self.id} took {self.total_seconds:.2f}s"
+        )
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "model_name": self.model_name,
+            "total_seconds": self.total_seconds,
+            "time_to_first_token": self.time_to_first_token,
+            "stages": dict(self.stages),
+            "tokens": dict(self.tokens),
+            "images": dict(self.images),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "learntales"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: dict[tuple, float] = defaultdict(float)
+        self._summaries: dict[tuple, list[float]] = defaultdict(lambda: [0.0, 0])
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            summary = self._summaries[(name, tuple(sorted(labels.items())))]
+            summary[0] += value
+            summary[1] += 1
+
+    def record(self, trace: StoryTrace):
+        self.inc("stories_total", model=trace.model_name)
+        self.observe("story_seconds", trace.total_seconds, model=trace.model_name)
+        for stage, seconds in trace.stages.items():
+            self.observe("stage_seconds", seconds, stage=stage)
+        if trace.time_to_first_token is not None:
+            self.observe(
+                "time_to_first_token_seconds",
+                trace.time_to_first_token,
+                model=trace.model_name,
+            )
+        for kind, tokens in trace.tokens.items():
+            self.inc("tokens_total", tokens, kind=kind, model=trace.model_name)
+        self.inc("images_total", trace.images["generated"], status="generated")
+        self.inc("images_total", trace.images["failed"], status="failed")
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {k: list(v) for k, v in self._summaries.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+        for name in sorted({name for name, _ in summaries}):
+            lines.append(f"# TYPE {self.prefix}_{name} summary")
+            for (n, labels), (total, count) in sorted(summaries.items()):
+                if n == name:
+                    lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {total}")
+                    lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+def _labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def start_metrics_server(
+    port: int, host: str = "0.0.0.0", registry: MetricsRegistry | None = None
+) -> ThreadingHTTPServer:
+    # processes without the api, like the streamlit app, expose their metrics here
+    registry = registry if registry is not None else metrics
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    logger.info(f"serving metrics on {host}:{server.server_port}/metrics")
+    return server
+
+
+metrics = MetricsRegistry()
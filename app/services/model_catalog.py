@@ -0,0 +1,83 @@
+import threading
+import time
+from typing import Hashable, List, Tuple
+
+from loguru import logger
+
+from app.services.llm import BaseChatModel
+
+
+class ModelCatalog:
+    def __init__(self, ttl: float = 10 * 60, retry_interval: float = 30):
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._models: dict[Hashable, List[Tuple]] = {}
+        self._refresh_at: dict[Hashable, float] = {}
+        self._refreshing: set[Hashable] = set()
+        self._key_locks: dict[Hashable, threading.Lock] = {}
+
+    @staticmethod
+    def key(llm: BaseChatModel) -> Hashable:
+        return llm.name, llm.api_key
+
+    def get(self, llm: BaseChatModel) -> List[Tuple]:
+        key = self.key(llm)
+        with self._lock:
+            models = self._models.get(key)
+            refresh_at = self._refresh_at.get(key, 0)
+            stale = time.monotonic() >= refresh_at
+            if models is not None and stale and key not in self._refreshing:
+                self._refreshing.add(key)
+                threading.Thread(
+                    target=self._refresh_in_background, args=(llm, key), daemon=True
+                ).start()
+        if models is not None:
+            # a stale list is served while the refresh runs in the background
+            return models
+        if not stale:
+            # the last attempt failed, wait for the retry interval
+            return []
+
+        # only one session loads an unknown catalog, the others wait for it
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    return self._models[key]
+                if time.monotonic() < self._refresh_at.get(key, 0):
+                    return []
+            return self.refresh(llm) or []
+
+    def refresh(self, llm: BaseChatModel) -> List[Tuple] | None:
+        key = self.key(llm)
+        try:
+            models = llm.get_available_models()
+        except Exception as e:
+            logger.opt(exception=e).error(
+                f"the models of {llm.name} could not be loaded"
+            )
+            with self._lock:
+                self._refresh_at[key] = time.monotonic() + self.retry_interval
+            return None
+        with self._lock:
+            self._models[key] = models
+            self._refresh_at[key] = time.monotonic() + self.ttl
+        return models
+
+    def invalidate(self, llm: BaseChatModel | None = None):
+        with self._lock:
+            if llm is None:
+                self._models.clear()
+                self._refresh_at.clear()
+            else:
+                self._models.pop(self.key(llm), None)
+                self._refresh_at.pop(self.key(llm), None)
+
+    def _refresh_in_background(self, llm: BaseChatModel, key: Hashable):
+        try:
+            self.refresh(llm)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
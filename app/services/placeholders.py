@@ -0,0 +1,87 @@
+import re
+from re import Pattern
+from typing import Iterator, NamedTuple
+
+# the innermost pair of brackets on a single line, so "[a [b] c]" yields "b"
+PLACEHOLDER_PATTERN = re.compile(r"\[([^\[\]\n]*)\]")
+WORD_PATTERN = re.compile(r"\w+")
+STOP_WORDS = {"a", "an", "the", "of", "with", "and", "in", "on", "at", "to", "is"}
+
+
+class Token(NamedTuple):
+    text: str
+    placeholder: str | None = None
+
+
+def tokenize(content: str, pattern: Pattern = PLACEHOLDER_PATTERN) -> Iterator[Token]:
+    position = 0
+    for match in pattern.finditer(content):
+        if len(match.group(1)) == 0:
+            continue
+        if match.start() > position:
+            yield Token(content[position : match.start()])
+        yield Token(match.group(0), match.group(1))
+        position = match.end()
+    if position < len(content):
+        yield Token(content[position:])
+
+
+def normalize_prompt(prompt: str) -> str:
+    # prompts that only differ in case, punctuation or filler words describe the
+    # same image, the word order is kept since it carries the meaning
+    words = [w for w in WORD_PATTERN.findall(prompt.lower()) if w not in STOP_WORDS]
+    return " ".join(words)
+
+
+def select_prompts(
+    prompts: list[str], max_prompts: int | None = None
+) -> dict[str, str]:
+    # maps every prompt to the first prompt of its normalized group, groups
+    # beyond max_prompts are dropped
+    representatives: dict[str, str] = {}
+    selected = {}
+    for prompt in prompts:
+        key = normalize_prompt(prompt)
+        if key not in representatives:
+            if max_prompts is not None and len(representatives) >= max_prompts:
+                continue
+            representatives[key] = prompt
+        selected[prompt] = representatives[key]
+    return selected
+
+
+class PlaceholderParser:
+    def __init__(self, pattern: Pattern = PLACEHOLDER_PATTERN, max_length: int = 1000):
+        self.pattern = pattern
+        self.max_length = max_length
+        self._pending = ""
+
+    def feed(self, chunk: str) -> list[Token]:
+        text = self._pending + chunk
+        if "[" not in text:
+            self._pending = ""
+            return [Token(text)] if len(text) > 0 else []
+        tokens = list(tokenize(text, self.pattern))
+        if len(tokens) == 0 or tokens[-1].placeholder is not None:
+            self._pending = ""
+            return tokens
+        # an open bracket at the end may still be closed by the next chunks
+        tail = tokens[-1].text
+        start = tail.rfind("[")
+        if (
+            start == -1
+            or "\n" in tail[start:]
+            or "]" in tail[start:]
+            or len(tail) - start > self.max_length
+        ):
+            self._pending = ""
+            return tokens
+        self._pending = tail[start:]
+        if start == 0:
+            return tokens[:-1]
+        return tokens[:-1] + [Token(tail[:start])]
+
+    def close(self) -> list[Token]:
+        tokens = [Token(self._pending)] if len(self._pending) > 0 else []
+        self._pending = ""
+        return tokens
@@ -0,0 +1,175 @@
+import math
+import time
+from functools import lru_cache
+from typing import Iterable, Iterator
+
+import tiktoken
+from loguru import logger
+
+DEFAULT_CONTEXT_WINDOW = 4096
+DEFAULT_ENCODING = "cl100k_base"
+SEPARATORS = ["\n\n", "\n", ". ", " "]
+ENCODING_RETRY_SECONDS = 60
+
+_failed_encodings: dict[str, float] = {}
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+def get_encoding(name: str = DEFAULT_ENCODING) -> tiktoken.Encoding | None:
+    # only loaded encodings are cached, a failed download is retried after a
+    # while instead of on every call
+    failed_at = _failed_encodings.get(name)
+    if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_SECONDS:
+        return None
+    try:
+        encoding = _load_encoding(name)
+    except Exception as e:
+        # e.g. an offline machine without the encoding in the tiktoken cache
+        logger.warning(f"encoding {name} could not be loaded, estimating tokens: {e}")
+        _failed_encodings[name] = time.monotonic()
+        return None
+    _failed_encodings.pop(name, None)
+    return encoding
+
+
+@lru_cache(maxsize=256)
+def encoding_name_for_model(model_name: str) -> str:
+    try:
+        return tiktoken.encoding_name_for_model(model_name)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+def count_tokens(text: str, encoding: str = DEFAULT_ENCODING) -> int:
+    encoder = get_encoding(encoding)
+    if encoder is None:
+        # roughly three characters per token keeps the estimate on the safe side
+        return math.ceil(len(text) / 3)
+    return len(encoder.encode_ordinary(text))
+
+
+def truncate(text: str, max_tokens: int, encoding: str = DEFAULT_ENCODING) -> str:
+    encoder = get_encoding(encoding)
+    if encoder is None:
+        return text[: max_tokens * 3]
+    tokens = encoder.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens])
+
+
+class PromptBudget:
+    def __init__(
+        self,
+        model_name: str,
+        context_window: int = DEFAULT_CONTEXT_WINDOW,
+        completion_tokens: int = 1500,
+    ):
+        self.model_name = model_name
+        self.context_window = context_window
+        self.completion_tokens = completion_tokens
+        self.encoding = encoding_name_for_model(model_name)
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.encoding)
+
+    def available(self, template: str) -> int:
+        return max(
+            0, self.context_window - self.completion_tokens - self.count(template)
+        )
+
+    def fits(self, template: str, content: str) -> bool:
+        return self.count(content) <= self.available(template)
+
+    def truncate(self, template: str, content: str) -> str:
+        return truncate(content, self.available(template), self.encoding)
+
+
+def read_paragraphs(
+    path: str, block_size: int = 1024 * 1024, max_chars: int | None = None
+) -> Iterator[str]:
+    max_chars = max_chars if max_chars is not None else 4 * block_size
+    with open(path, encoding="utf-8") as f:
+        pending = ""
+        while block := f.read(block_size):
+            # the text before the block was already searched, only a break that
+            # starts at its last character can be new
+            start = max(0, len(pending) - 1)
+            pending += block
+            end = pending.rfind("\n\n", start)
+            if end != -1:
+                yield from (p for p in pending[:end].split("\n\n") if p.strip())
+                pending = pending[end + 2 :]
+            elif len(pending) >= max_chars:
+                # text without blank lines is cut at a line or a word, so the
+                # buffer stays bounded
+                end = pending.rfind("\n", start)
+                end = end if end > 0 else pending.rfind(" ", start)
+                end = end if end > 0 else len(pending)
+                if pending[:end].strip():
+                    yield pending[:end]
+                pending = pending[end:]
+        if pending.strip():
+            yield pending
+
+
+def split_tokens(
+    paragraphs: Iterable[str],
+    chunk_tokens: int = 1000,
+    chunk_overlap: int = 0,
+    encoding: str = DEFAULT_ENCODING,
+) -> Iterator[str]:
+    chunk: list[tuple[str, int]] = []
+    chunk_size = 0
+    for paragraph in paragraphs:
+        for piece, tokens in _pieces(
+            paragraph.strip() + "\n\n", chunk_tokens, encoding
+        ):
+            # whitespace is stripped from the chunks, so it never starts a new one
+            if chunk and chunk_size + tokens > chunk_tokens and piece.strip():
+                yield "".join(p for p, _ in chunk).strip()
+                # keep the tail of the chunk as overlap for the next one
+                while chunk and (
+                    chunk_size > chunk_overlap or chunk_size + tokens > chunk_tokens
+                ):
+                    chunk_size -= chunk.pop(0)[1]
+            chunk.append((piece, tokens))
+            chunk_size += tokens
+    if chunk:
+        yield "".join(p for p, _ in chunk).strip()
+
+
+def _pieces(
+    text: str, chunk_tokens: int, encoding: str, separators: list[str] = SEPARATORS
+) -> Iterator[tuple[str, int]]:
+    tokens = count_tokens(text, encoding)
+    if tokens <= chunk_tokens:
+        yield text, tokens
+        return
+    for i, separator in enumerate(separators):
+        parts = text.split(separator)
+        if len(parts) > 1:
+            for part in parts[:-1]:
+                yield from _pieces(
+                    part + separator, chunk_tokens, encoding, separators[i + 1 :]
+                )
+            if parts[-1]:
+                yield from _pieces(
+                    parts[-1], chunk_tokens, encoding, separators[i + 1 :]
+                )
+            return
+    # a single word that is longer than a chunk is cut into token slices
+    encoder = get_encoding(encoding)
+    if encoder is None:
+        width = chunk_tokens * 3
+        for start in range(0, len(text), width):
+            yield text[start : start + width], chunk_tokens
+        return
+    ids = encoder.encode_ordinary(text)
+    for start in range(0, len(ids), chunk_tokens):
+        piece = ids[start : start + chunk_tokens]
+        yield encoder.decode(piece), len(piece)
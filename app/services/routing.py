@@ -0,0 +1,272 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, List, Tuple
+
+from langchain_core.messages import BaseMessage
+from loguru import logger
+
+from app.services.llm import BaseChatModel
+from app.services.metrics import metrics
+
+# the route that answered the last request, kept per thread and context so
+# concurrent stories don't see each other's backend
+answered_route: ContextVar["Route | None"] = ContextVar("answered_route", default=None)
+
+
+class BackendHealth:
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30,
+        window: int = 100,
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self._trial_running = False
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                # a single trial request decides whether the breaker closes again
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.latency = (
+                latency
+                if self.latency is None
+                else self.alpha * latency + (1 - self.alpha) * self.latency
+            )
+            self.error_rate = (1 - self.alpha) * self.error_rate
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+            self.consecutive_failures += 1
+            if (
+                self._trial_running
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def p95(self) -> float | None:
+        with self._lock:
+            if len(self._latencies) < 5:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "p95": self.p95(),
+        }
+
+
+class Route:
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        weight: float = 1.0,
+        model_names: dict[str, str] | None = None,
+        health: BackendHealth | None = None,
+    ):
+        self.llm = llm
+        self.weight = weight
+        self.model_names = model_names if model_names is not None else {}
+        self.health = health if health is not None else BackendHealth()
+
+    @property
+    def name(self) -> str:
+        return self.llm.name[0]
+
+    def model_name(self, model_name: str) -> str:
+        return self.model_names.get(model_name, model_name)
+
+    def score(self) -> float:
+        latency = self.health.latency if self.health.latency is not None else 0.0
+        # slow or failing backends get a smaller share of the requests
+        return self.weight * (1 - self.health.error_rate) / (1 + latency)
+
+
+class RoutingChatModel(BaseChatModel):
+    def __init__(
+        self,
+        routes: List[Route],
+        hedge: bool = False,
+        hedge_delay: float = 2.0,
+        max_workers: int = 8,
+        rng: random.Random | None = None,
+    ):
+        super().__init__("Routing", api_key=routes[0].llm.api_key)
+        self.routes = routes
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.rng = rng if rng is not None else random.Random()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="routing"
+        )
+
+    def get_available_models(self) -> List[Tuple]:
+        # the model names of the primary backend are the ones users pick from
+        return self.routes[0].llm.get_available_models()
+
+    def get_context_window(self, model_name: str) -> int:
+        return min(
+            r.llm.get_context_window(r.model_name(model_name)) for r in self.routes
+        )
+
+    def invoke(self, model_name: str, prompt: str, labels: dict = None) -> BaseMessage:
+        return self._call(
+            lambda route: route.llm.invoke(
+                model_name=route.model_name(model_name), prompt=prompt, labels=labels
+            )
+        )
+
+    def stream(
+        self, model_name: str, prompt: str, labels: dict = None
+    ) -> Iterator[str]:
+        def start(route: Route) -> tuple[str, Iterator[str]]:
+            chunks = iter(
+                route.llm.stream(
+                    model_name=route.model_name(model_name),
+                    prompt=prompt,
+                    labels=labels,
+                )
+            )
+            # the time to the first chunk counts as latency of the backend
+            return next(chunks, ""), chunks
+
+        first_chunk, chunks = self._call(start, close=lambda r: r[1].close())
+        yield first_chunk
+        # once text was streamed, a failing backend can't be swapped anymore
+        yield from chunks
+
+    def warm_up(self, model_name: str):
+        for route in self.routes:
+            try:
+                route.llm.warm_up(route.model_name(model_name))
+            except Exception as e:
+                logger.warning(f"failed to warm up backend {route.name}: {e}")
+
+    def fell_back(self) -> bool:
+        route = answered_route.get()
+        return route is not None and route is not self.routes[0]
+
+    def health(self) -> dict[str, dict]:
+        return {route.name: route.health.to_dict() for route in self.routes}
+
+    def order(self) -> List[Route]:
+        available = [r for r in self.routes if r.health.state != "open"]
+        if len(available) == 0:
+            return []
+        # the first backend is picked by weight, the others follow as fallbacks
+        scores = [r.score() for r in available]
+        if sum(scores) > 0:
+            first = self.rng.choices(available, weights=scores)[0]
+        else:
+            # backends without a share of the traffic are still used as fallbacks
+            first = available[0]
+        return [first] + sorted(
+            (r for r in available if r is not first), key=lambda r: -r.score()
+        )
+
+    def _call(self, fn: Callable[[Route], Any], close: Callable | None = None) -> Any:
+        answered_route.set(None)
+        routes = self.order()
+        if self.hedge and len(routes) > 1:
+            return self._call_hedged(fn, routes, close)
+        error = RuntimeError("no backend is available")
+        for route in routes:
+            if not route.health.allow():
+                continue
+            try:
+                result = self._run(route, fn)
+                answered_route.set(route)
+                return result
+            except Exception as e:
+                logger.warning(f"backend {route.name} failed, trying the next: {e}")
+                error = e
+        raise error
+
+    def _call_hedged(
+        self, fn: Callable[[Route], Any], routes: List[Route], close: Callable | None
+    ) -> Any:
+        pending: dict[Future, Route] = {}
+        remaining = list(routes)
+        error = RuntimeError("no backend is available")
+        delay = None
+        while remaining or pending:
+            if remaining:
+                route = remaining.pop(0)
+                if not route.health.allow():
+                    continue
+                pending[self._executor.submit(self._run, route, fn)] = route
+                # the next backend is fired once this one is slower than its p95
+                p95 = route.health.p95()
+                delay = p95 if p95 is not None else self.hedge_delay
+            done, _ = wait(
+                pending,
+                timeout=delay if remaining else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is not None:
+                    logger.warning(
+                        f"backend {winner.name} failed: {future.exception()}"
+                    )
+                    error = future.exception()
+                    continue
+                if close is not None:
+                    for loser in pending:
+                        loser.add_done_callback(
+                            lambda f: f.exception() is None and close(f.result())
+                        )
+                answered_route.set(winner)
+                return future.result()
+        raise error
+
+    def _run(self, route: Route, fn: Callable[[Route], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            result = fn(route)
+        except Exception:
+            route.health.record_failure()
+            metrics.inc("backend_requests_total", backend=route.name, status="failed")
+            raise
+        route.health.record_success(time.perf_counter() - start)
+        metrics.inc("backend_requests_total", backend=route.name, status="ok")
+        return result
@@ -1,20 +1,56 @@
+import html
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from re import Pattern
-from typing import List
+from typing import Callable, Generator, List
 
-from langchain_community.document_loaders import UnstructuredURLLoader
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_text_splitters import CharacterTextSplitter
+from loguru import logger
 
+from app.helper.html_helper import markdown_to_html, sanitize_html
 from app.helper.img_helper import save_base64_image
+from app.services.cache import Cache
+from app.services.condenser import DocumentCondenser
+from app.services.image_scheduler import ImageScheduler
+from app.services.image_store import ImageStore
+from app.services.ingestion import WebIngestor
 from app.services.llm import BaseChatModel
+from app.services.metrics import StoryTrace
+from app.services.prompt_budget import PromptBudget, read_paragraphs, split_tokens
+from app.services.placeholders import (
+    PLACEHOLDER_PATTERN,
+    PlaceholderParser,
+    normalize_prompt,
+    select_prompts,
+    tokenize,
+)
+
+IMAGE_MARKER_PATTERN = re.compile(r"@@image-(\d+)@@")
 
 
 class StoryTeller:
 
-    def __init__(self, llm: BaseChatModel, visionModel: any):
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        visionModel: any,
+        cache: Cache | None = None,
+        condenser: DocumentCondenser | None = None,
+        image_store: ImageStore | None = None,
+        ingestor: WebIngestor | None = None,
+        max_images: int | None = 2,
+        condense: bool = True,
+    ):
         self.llm = llm
         self.visionModel = visionModel
+        self.cache = cache
+        self.condenser = condenser
+        self.image_store = image_store
+        self.ingestor = ingestor if ingestor is not None else WebIngestor(cache=cache)
+        self.max_images = max_images
+        self.condense = condense
+        self.last_trace: StoryTrace | None = None
 
     @staticmethod
     def get_context(
@@ -24,7 +60,7 @@ class StoryTeller:
            You are a storyteller for an audience of {audience} aged {from_year} to {to_year}. Create an engaging and
            easy-to-understand story based on the information provided within the single hash marks up to 800 words.
            Include placeholders for up to 2 images using the following syntax: [image description for prompting].
-           Inside the brackets, write a prompt describing
+           Inside the brackets, write a prompt in english describing
             the image for another model to generate. You can create up to three protagonists.
             Please write the response only in {language}.
         """
@@ -36,35 +72,27 @@ class StoryTeller:
         chunk_size: int = 1000,
         chunk_overlap: int = 0,
     ) -> list[str]:
-        file = Path(file_path)
-        if file.exists():
-            with open(file_path) as f:
-                content = f.read()
-                text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
-                    encoding=encoding,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                )
-                texts = text_splitter.split_text(content)
-                return texts
-
-        else:
+        if not Path(file_path).exists():
             raise FileNotFoundError(f"file at {file_path} does not exist.")
+        # the file is read block by block, so only the chunks and not the raw
+        # text of the whole file are held in memory
+        return list(
+            split_tokens(
+                read_paragraphs(file_path),
+                chunk_tokens=chunk_size,
+                chunk_overlap=chunk_overlap,
+                encoding=encoding,
+            )
+        )
 
     @staticmethod
     def extract_placeholders_from_text(
-        content: str, pattern: str = r"\[(.*?)\]"
+        content: str, pattern: str | Pattern = PLACEHOLDER_PATTERN
     ) -> [str]:
-        import re
-
-        matches = re.findall(pattern, content)
-        matches = [m for m in matches if m is not None and len(m) > 0]
-        return matches
+        return [m for m in re.compile(pattern).findall(content) if len(m) > 0]
 
-    def load_from_website(self, urls: List[str]):
-        loader = UnstructuredURLLoader(urls=urls)
-        docs = loader.load()
-        return docs[0].page_content if len(docs) > 0 else ""
+    def load_from_website(self, urls: List[str]) -> str:
+        return self.ingestor.load_text(urls)
 
     def generate_images_from_prompt(
         self, image_prompts: [str], output_folder_path: str | None, fake: bool
@@ -75,12 +103,42 @@ class StoryTeller:
                 for key in image_prompts
             }
 
-        images = self.visionModel.generate_images(image_prompts)
+        selected = select_prompts(image_prompts)
+        prompts = list(dict.fromkeys(selected.values()))
+        lock = threading.Lock()
+        refined = set()
+
+        def save_refined(key: str, value: str):
+            with lock:
+                refined.add(key)
+                save_base64_image(value, self.get_image_path(output_folder_path, key))
+
+        if output_folder_path is not None and isinstance(
+            self.visionModel, ImageScheduler
+        ):
+            # refined versions replace the previews in the output folder
+            images = self.visionModel.generate_images(prompts, on_refined=save_refined)
+        else:
+            images = self.visionModel.generate_images(prompts)
         for key, value in images.items():
             if output_folder_path is not None:
-                file_name = key.replace(" ", "_")
-                save_base64_image(value, f"{output_folder_path}/{file_name}.jpg")
-        return images
+                with lock:
+                    # a refinement that finished first is not overwritten
+                    if key not in refined:
+                        save_base64_image(
+                            value, self.get_image_path(output_folder_path, key)
+                        )
+        return {p: images[rep] for p, rep in selected.items() if rep in images}
+
+    @staticmethod
+    def get_image_path(output_folder_path: str, prompt: str) -> str:
+        file_name = prompt.replace(" ", "_")
+        return f"{output_folder_path}/{file_name}.jpg"
+
+    def get_image_src(self, base64_image: str) -> str:
+        if self.image_store is None:
+            return f"data:image/jpeg;base64,{base64_image}"
+        return self.image_store.url(self.image_store.put(base64_image))
 
     def transform_text_to_html(
         self,
@@ -88,21 +146,131 @@ class StoryTeller:
         images: dict[str, str],
         model_name: str,
         with_llm: bool = False,
+        trace: StoryTrace | None = None,
     ) -> str:
-        for key, value in images.items():
-            content = content.replace(
-                f"[{key}]",
-                f"<img src='data:image/jpeg;base64,{value}' alt='{key}' "
-                f"style='float: left; margin: 10px; width: 150px' />",
-            )
+        # images are swapped for short markers, so neither the sanitizer nor the
+        # llm has to handle the base64 data
+        tags: list[str] = []
+        markers: dict[str, str] = {}
+        parts = []
+        for token in tokenize(content):
+            if token.placeholder not in images:
+                parts.append(token.text)
+                continue
+            if token.placeholder not in markers:
+                markers[token.placeholder] = f"@@image-{len(tags)}@@"
+                tags.append(
+                    f"<img src='{self.get_image_src(images[token.placeholder])}' "
+                    f"alt='{html.escape(token.placeholder)}' "
+                    f"style='float: left; margin: 10px; width: 150px' />"
+                )
+            parts.append(markers[token.placeholder])
+        content = "".join(parts)
+
+        html_content = None
         if with_llm:
-            result = self.llm.invoke(
-                model_name=model_name,
-                prompt=f"Adjust the following content in single quotes to be valid html and return it as string: '{content}'",
+            html_content = self.clean_up_html_with_llm(
+                content, len(tags), model_name, trace=trace
             )
-            return result.content
+        if html_content is None:
+            html_content = markdown_to_html(content)
+        return IMAGE_MARKER_PATTERN.sub(
+            lambda m: tags[int(m.group(1))] if int(m.group(1)) < len(tags) else "",
+            html_content,
+        )
+
+    def clean_up_html_with_llm(
+        self,
+        content: str,
+        image_count: int,
+        model_name: str,
+        trace: StoryTrace | None = None,
+    ) -> str | None:
+        trace = trace if trace is not None else StoryTrace(model_name)
+        prompt = (
+            "Adjust the following content in single quotes to be valid html and return it "
+            f"as string. Keep markers like @@image-0@@ unchanged: '{content}'"
+        )
+        with trace.stage("html_llm_cleanup"):
+            result = self.llm.invoke(model_name=model_name, prompt=prompt)
+        trace.count_tokens("prompt", prompt)
+        trace.count_tokens("completion", result.content)
+        found = {int(i) for i in IMAGE_MARKER_PATTERN.findall(result.content)}
+        if found != set(range(image_count)):
+            logger.warning("the llm dropped image markers, using the local sanitizer")
+            return None
+        return sanitize_html(result.content)
 
-        return f"{content}"
+    def get_prompt(
+        self,
+        original_content: str,
+        audience: str,
+        from_year: int,
+        to_year: int,
+        language: str,
+    ) -> str:
+        return (
+            self.get_context(
+                audience=audience,
+                from_year=from_year,
+                to_year=to_year,
+                language=language,
+            )
+            + original_content
+        )
+
+    def fit_to_context(self, content: str, model_name: str, template: str) -> str:
+        budget = PromptBudget(
+            model_name, context_window=self.llm.get_context_window(model_name)
+        )
+        if budget.fits(template, content):
+            return content
+        if self.condense:
+            # documents are only summarized when they don't fit the model's context
+            logger.info(f"content exceeds the context of {model_name}, condensing it")
+            condenser = (
+                self.condenser
+                if self.condenser is not None
+                else DocumentCondenser(llm=self.llm, cache=self.cache)
+            )
+            content = condenser.condense_text(
+                content, model_name, max_tokens=budget.available(template)
+            )
+            if budget.fits(template, content):
+                return content
+        logger.warning(f"content exceeds the context of {model_name}, truncating it")
+        return budget.truncate(template, content)
+
+    def cache_story(self, story_key: str, content: str):
+        if self.cache is None:
+            return
+        # the key names the requested model, stories of a fallback don't match it
+        if self.llm.fell_back():
+            logger.info("not caching the story, a fallback backend told it")
+            return
+        self.cache.set("story", story_key, content)
+
+    def get_story_cache_key(
+        self,
+        original_content: str,
+        model_name: str,
+        audience: str,
+        from_year: int,
+        to_year: int,
+        language: str,
+    ) -> str:
+        template = self.get_context(
+            audience=audience, from_year=from_year, to_year=to_year, language=language
+        )
+        return Cache.make_key(
+            model_name,
+            audience,
+            from_year,
+            to_year,
+            language,
+            template,
+            original_content,
+        )
 
     def tell(
         self,
@@ -112,23 +280,297 @@ class StoryTeller:
         from_year: int,
         to_year: int,
         language: str,
+        output_folder_path: str | None = None,
     ) -> str:
-        text = original_content
-        result = self.llm.invoke(
+        trace = StoryTrace(model_name)
+        story_key = self.get_story_cache_key(
+            original_content=original_content,
             model_name=model_name,
-            prompt=f"{self.get_context(
             audience=audience,
             from_year=from_year,
             to_year=to_year,
-            language=language
-        ) + original_content}",
+            language=language,
         )
-        content = result.content
-        placeholders = self.extract_placeholders_from_text(content)
-        generated_images = self.generate_images_from_prompt(
-            placeholders, output_folder_path=None, fake=False
+        content = self.cache.get("story", story_key) if self.cache is not None else None
+        if content is None:
+            with trace.stage("condense"):
+                condensed_content = self.fit_to_context(
+                    original_content,
+                    model_name,
+                    template=self.get_context(
+                        audience=audience,
+                        from_year=from_year,
+                        to_year=to_year,
+                        language=language,
+                    ),
+                )
+            prompt = self.get_prompt(
+                original_content=condensed_content,
+                audience=audience,
+                from_year=from_year,
+                to_year=to_year,
+                language=language,
+            )
+            with trace.stage("llm"):
+                result = self.llm.invoke(model_name=model_name, prompt=prompt)
+            content = result.content
+            trace.count_tokens("prompt", prompt)
+            trace.count_tokens("completion", content)
+            self.cache_story(story_key, content)
+        with trace.stage("extract_placeholders"):
+            placeholders = list(
+                select_prompts(
+                    self.extract_placeholders_from_text(content), self.max_images
+                )
+            )
+        with trace.stage("generate_images"):
+            generated_images = self.generate_images_from_prompt(
+                placeholders, output_folder_path=output_folder_path, fake=False
+            )
+        trace.count_images(
+            len({normalize_prompt(p) for p in placeholders}),
+            len({normalize_prompt(p) for p in generated_images}),
+        )
+        with trace.stage("transform_html"):
+            html_content = self.transform_text_to_html(
+                content, generated_images, model_name=model_name, trace=trace
+            )
+        self.last_trace = trace.finish()
+        return html_content
+
+    def tell_variants(
+        self,
+        original_content: str,
+        model_name: str,
+        audience: str,
+        variants: list[tuple[str, int, int]],
+        output_folder_path: str | None = None,
+        max_workers: int = 4,
+    ) -> dict[tuple[str, int, int], str | Exception]:
+        trace = StoryTrace(model_name)
+        variants = list(dict.fromkeys(variants))
+        story_keys = {
+            (language, from_year, to_year): self.get_story_cache_key(
+                original_content=original_content,
+                model_name=model_name,
+                audience=audience,
+                from_year=from_year,
+                to_year=to_year,
+                language=language,
+            )
+            for language, from_year, to_year in variants
+        }
+        contents = {
+            variant: self.cache.get("story", key) if self.cache is not None else None
+            for variant, key in story_keys.items()
+        }
+        missing = [variant for variant, content in contents.items() if content is None]
+        if len(missing) > 0:
+            # the content is condensed once for all variants, the longest
+            # template decides whether it fits
+            templates = {
+                variant: self.get_context(
+                    audience=audience,
+                    from_year=variant[1],
+                    to_year=variant[2],
+                    language=variant[0],
+                )
+                for variant in missing
+            }
+            with trace.stage("condense"):
+                condensed_content = self.fit_to_context(
+                    original_content,
+                    model_name,
+                    template=max(templates.values(), key=len),
+                )
+            prompts = {
+                variant: templates[variant] + condensed_content for variant in missing
+            }
+
+            def invoke(variant: tuple[str, int, int]) -> str | Exception:
+                # a failed variant is returned as its error, the others go on
+                try:
+                    content = self.llm.invoke(
+                        model_name=model_name, prompt=prompts[variant]
+                    ).content
+                except Exception as e:
+                    logger.error(f"failed to tell the variant {variant}: {e}")
+                    return e
+                self.cache_story(story_keys[variant], content)
+                return content
+
+            with trace.stage("llm"), ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="story-variants"
+            ) as executor:
+                for variant, content in zip(missing, executor.map(invoke, missing)):
+                    contents[variant] = content
+            for variant in missing:
+                if isinstance(contents[variant], Exception):
+                    continue
+                trace.count_tokens("prompt", prompts[variant])
+                trace.count_tokens("completion", contents[variant])
+
+        with trace.stage("extract_placeholders"):
+            placeholders = {
+                variant: list(
+                    select_prompts(
+                        self.extract_placeholders_from_text(content), self.max_images
+                    )
+                )
+                for variant, content in contents.items()
+                if not isinstance(content, Exception)
+            }
+            all_placeholders = [p for ps in placeholders.values() for p in ps]
+        # prompts that normalize to the same image are drawn once for all variants
+        with trace.stage("generate_images"):
+            generated_images = self.generate_images_from_prompt(
+                all_placeholders,
+                output_folder_path=output_folder_path,
+                fake=False,
+            )
+        trace.count_images(
+            len({normalize_prompt(p) for p in all_placeholders}),
+            len({normalize_prompt(p) for p in generated_images}),
         )
-        html_content = self.transform_text_to_html(
-            content, generated_images, model_name=model_name, with_llm=False
+
+        stories = {}
+        with trace.stage("transform_html"):
+            for variant, content in contents.items():
+                if isinstance(content, Exception):
+                    stories[variant] = content
+                    continue
+                images = {
+                    p: generated_images[p]
+                    for p in placeholders[variant]
+                    if p in generated_images
+                }
+                stories[variant] = self.transform_text_to_html(
+                    content, images, model_name=model_name, trace=trace
+                )
+        self.last_trace = trace.finish()
+        return stories
+
+    def tell_stream(
+        self,
+        original_content: str,
+        model_name: str,
+        audience: str,
+        from_year: int,
+        to_year: int,
+        language: str,
+        pattern: str | Pattern = PLACEHOLDER_PATTERN,
+        max_image_workers: int = 2,
+        on_images: Callable[[int, int], None] | None = None,
+    ) -> Generator[str, None, str]:
+        trace = StoryTrace(model_name)
+        story_key = self.get_story_cache_key(
+            original_content=original_content,
+            model_name=model_name,
+            audience=audience,
+            from_year=from_year,
+            to_year=to_year,
+            language=language,
+        )
+        cached_story = (
+            self.cache.get("story", story_key) if self.cache is not None else None
+        )
+        prompt = None
+        if cached_story is not None:
+            chunks = [cached_story]
+        else:
+            with trace.stage("condense"):
+                condensed_content = self.fit_to_context(
+                    original_content,
+                    model_name,
+                    template=self.get_context(
+                        audience=audience,
+                        from_year=from_year,
+                        to_year=to_year,
+                        language=language,
+                    ),
+                )
+            prompt = self.get_prompt(
+                original_content=condensed_content,
+                audience=audience,
+                from_year=from_year,
+                to_year=to_year,
+                language=language,
+            )
+            chunks = self.llm.stream(model_name=model_name, prompt=prompt)
+        parser = PlaceholderParser(re.compile(pattern))
+        executor = ThreadPoolExecutor(
+            max_workers=max_image_workers, thread_name_prefix="story-images"
         )
+        pending_images: dict[str, Future] = {}
+        # near-identical placeholders share the image of the first one
+        representatives: dict[str, str] = {}
+        aliases: dict[str, str] = {}
+
+        def report_images(_: Future | None = None):
+            if on_images is not None:
+                futures = list(pending_images.values())
+                on_images(sum(f.done() for f in futures), len(futures))
+
+        parts = []
+        try:
+            chunks = iter(chunks)
+            while True:
+                # only the model is timed, not the consumer of the yielded chunks
+                with trace.stage("llm"):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                trace.first_token()
+                parts.append(chunk)
+                # placeholders split across chunks are emitted once closed
+                for token in parser.feed(chunk):
+                    placeholder = token.placeholder
+                    if placeholder is None or placeholder in aliases:
+                        continue
+                    key = normalize_prompt(placeholder)
+                    if key in representatives:
+                        aliases[placeholder] = representatives[key]
+                    elif (
+                        self.max_images is None
+                        or len(representatives) < self.max_images
+                    ):
+                        representatives[key] = placeholder
+                        aliases[placeholder] = placeholder
+                        logger.debug(f"start image generation for {placeholder}")
+                        pending_images[placeholder] = executor.submit(
+                            self.generate_images_from_prompt,
+                            [placeholder],
+                            output_folder_path=None,
+                            fake=False,
+                        )
+                        pending_images[placeholder].add_done_callback(report_images)
+                        report_images()
+                yield chunk
+            text = "".join(parts)
+            if prompt is not None:
+                trace.count_tokens("prompt", prompt)
+                trace.count_tokens("completion", text)
+            if cached_story is None:
+                self.cache_story(story_key, text)
+
+            images = {}
+            with trace.stage("generate_images"):
+                for placeholder, future in pending_images.items():
+                    try:
+                        images.update(future.result())
+                    except Exception as e:
+                        logger.error(f"failed to generate image for {placeholder}: {e}")
+                report_images()
+            trace.count_images(len(pending_images), len(images))
+            generated_images = {
+                p: images[rep] for p, rep in aliases.items() if rep in images
+            }
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        with trace.stage("transform_html"):
+            html_content = self.transform_text_to_html(
+                text, generated_images, model_name=model_name, trace=trace
+            )
+        self.last_trace = trace.finish()
         return html_content
@@ -1,10 +1,20 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from langchain_nvidia_ai_endpoints import ChatNVIDIA
 from loguru import logger
 
+from app.helper.async_helper import run_sync
+from app.services.cache import Cache
+from app.services.llm import ClientPool, keep_alive_session
+from app.services.metrics import metrics
+
 
 class VisualModel:
+    # the number of prompts a single request may carry, None for no limit
+    max_batch_size: int | None = None
+
     def __init__(self, name: str):
         logger.info("initialize visual model")
 
@@ -13,30 +23,120 @@ class VisualModel:
     ) -> dict[str, str]:
         raise NotImplementedError()
 
+    async def agenerate_images(
+        self, prompts: list[str], iterations: int = 4
+    ) -> dict[str, str]:
+        return await asyncio.to_thread(self.generate_images, prompts, iterations)
+
+    def warm_up(self, iterations: int = 1):
+        pass
+
 
 class NvidiaFoundationVisionModel(VisualModel):
 
-    def __init__(self, api_key: str, model_name: str = "ai-sdxl-lightning"):
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "ai-sdxl-lightning",
+        max_concurrency: int = 4,
+        timeout: float = 60,
+        retries: int = 2,
+        backoff: float = 0.5,
+        weight: int = 1,
+        cache: Cache | None = None,
+    ):
         super().__init__("Nvidia Foundation")
         self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.weight = weight
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="image-gen"
+        )
+        self._session = keep_alive_session(
+            pool_maxsize=max_concurrency, timeout=timeout
+        )
+        self._generators = ClientPool(
+            lambda key: self._build_image_gen(*key), max_size=max_concurrency
+        )
         os.environ["NVIDIA_API_KEY"] = api_key
 
     def generate_images(
         self, prompts: list[str], iterations: int = 1
+    ) -> dict[str, str]:
+        return run_sync(self.agenerate_images(prompts, iterations=iterations))
+
+    async def agenerate_images(
+        self, prompts: list[str], iterations: int = 1
     ) -> dict[str, str]:
         result = {}
-        generator = self._build_image_gen(iterations=iterations)
-        for p in prompts:
+        keys = {p: self._image_cache_key(p, iterations) for p in dict.fromkeys(prompts)}
+        if self.cache is not None:
+            for p, key in keys.items():
+                cached_image = self.cache.get("image", key)
+                if cached_image is not None:
+                    result[p] = cached_image
+        prompts = [p for p in keys if p not in result]
+        if len(prompts) == 0:
+            return result
+        generator_key = (iterations, self.weight)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def generate(prompt: str) -> str:
+            async with semaphore:
+                return await self._agenerate_image(generator_key, prompt)
+
+        images = await asyncio.gather(
+            *[generate(p) for p in prompts], return_exceptions=True
+        )
+        for p, image in zip(prompts, images):
+            if isinstance(image, BaseException):
+                logger.error(f"failed to generate image due to {image!r}")
+            else:
+                result[p] = image
+                if self.cache is not None:
+                    self.cache.set("image", keys[p], image)
+        return result
+
+    def warm_up(self, iterations: int = 1):
+        with self._generators.acquire((iterations, self.weight)):
+            pass
+
+    def _image_cache_key(self, prompt: str, iterations: int) -> str:
+        return Cache.make_key(self.model_name, iterations, self.weight, prompt)
+
+    async def _agenerate_image(self, generator_key: tuple, prompt: str) -> str:
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
             try:
-                logger.debug(f"generating image for {p} using {self.model_name}")
-                model_res = generator.invoke(p)
-                base64_img = model_res.response_metadata["artifacts"][0]["base64"]
-                result[p] = base64_img
+                return await loop.run_in_executor(
+                    self._executor, self._invoke, generator_key, prompt
+                )
             except Exception as e:
-                logger.error(f"failed to generate image due to {e}")
-        return result
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2**attempt
+                logger.warning(
+                    f"image generation for {prompt} failed ({e!r}), retrying in {delay}s"
+                )
+                await asyncio.sleep(delay)
+
+    def _invoke(self, generator_key: tuple, prompt: str) -> str:
+        logger.debug(f"generating image for {prompt} using {self.model_name}")
+        start = time.perf_counter()
+        with self._generators.acquire(generator_key) as generator:
+            model_res = generator.invoke(prompt)
+        metrics.observe(
+            "image_seconds", time.perf_counter() - start, model=self.model_name
+        )
+        return model_res.response_metadata["artifacts"][0]["base64"]
 
     def _build_image_gen(self, iterations: int = 4, weight: int = 1):
+        from langchain_nvidia_ai_endpoints import ChatNVIDIA
+
         img_gen = ChatNVIDIA(model=self.model_name)
 
         def to_sdxl_payload(d):
@@ -56,4 +156,7 @@ class NvidiaFoundationVisionModel(VisualModel):
             return d
 
         img_gen.client.payload_fn = to_sdxl_payload
+        img_gen.client.get_session_fn = lambda: self._session
+        # bounds the polling of queued requests, the session bounds each request
+        img_gen.client.timeout = self.timeout
         return img_gen
@@ -0,0 +1,76 @@
+import argparse
+import importlib
+import json
+import time
+from typing import Callable, List
+
+from loguru import logger
+
+from app.services.llm import BaseChatModel, NvidiaFoundationChatModel
+from app.services.prompt_budget import (
+    DEFAULT_ENCODING,
+    encoding_name_for_model,
+    get_encoding,
+)
+from app.services.vision_model import VisualModel
+
+# backends that are imported lazily, so the first story would pay for them
+WARM_UP_MODULES = [
+    "langchain_nvidia_ai_endpoints",
+    "langchain_text_splitters",
+    "markdown",
+    "PIL.Image",
+]
+
+
+def warm_up(
+    model_names: List[str] | None = None,
+    llm: BaseChatModel | None = None,
+    vision_model: VisualModel | None = None,
+    modules: List[str] = WARM_UP_MODULES,
+) -> dict[str, float]:
+    model_names = model_names if model_names is not None else []
+    timings = {}
+
+    def step(name: str, fn: Callable):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            logger.warning(f"warm-up of {name} failed: {e}")
+        timings[name] = time.perf_counter() - start
+
+    for module in modules:
+        step(f"import {module}", lambda m=module: importlib.import_module(m))
+    encodings = [DEFAULT_ENCODING] + [encoding_name_for_model(m) for m in model_names]
+    for encoding in dict.fromkeys(encodings):
+        step(f"encoding {encoding}", lambda e=encoding: get_encoding(e))
+    if llm is not None:
+        for model_name in model_names:
+            step(f"client {model_name}", lambda m=model_name: llm.warm_up(m))
+    if vision_model is not None:
+        step("vision client", vision_model.warm_up)
+    logger.info(f"warmed up in {sum(timings.values()):.2f}s")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the lazy imports and tokenizer encodings ahead of time"
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        dest="models",
+        help="model whose encoding is loaded (default: the NVIDIA models)",
+    )
+    args = parser.parse_args()
+
+    timings = warm_up(
+        model_names=args.models or list(NvidiaFoundationChatModel.context_windows)
+    )
+    print(json.dumps(timings, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from langchain_nvidia_ai_endpoints import ChatNVIDIA
+from loguru import logger
+
+from app.services.llm import NvidiaFoundationChatModel
+
+MODEL_NAME = "stub/llama3"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = set()
+
+    def do_GET(self):
+        self._respond({"data": [{"id": MODEL_NAME, "owned_by": "stub"}]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond(
+            {
+                "id": "stub",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "Once upon a time"},
+                        "finish_reason": "stop",
+                    }
+                ],
+            }
+        )
+
+    def _respond(self, body: dict):
+        StubHandler.connections.add(self.client_address)
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(invoke, calls: int) -> dict:
+    StubHandler.connections = set()
+    invoke()
+    start = time.perf_counter()
+    for _ in range(calls):
+        invoke()
+    elapsed = time.perf_counter() - start
+    return {
+        "per_call_ms": elapsed / calls * 1000,
+        "connections": len(StubHandler.connections),
+    }
+
+
+def run(calls: int = 200) -> dict:
+    server = start_stub_server()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    try:
+
+        def invoke_without_pool():
+            ChatNVIDIA(model=MODEL_NAME, base_url=base_url).invoke("tell me a story")
+
+        pooled = NvidiaFoundationChatModel(api_key="nvapi-stub", base_url=base_url)
+
+        def invoke_with_pool():
+            pooled.invoke(model_name=MODEL_NAME, prompt="tell me a story")
+
+        return {
+            "calls": calls,
+            "without_pool": measure(invoke_without_pool, calls),
+            "with_pool": measure(invoke_with_pool, calls),
+        }
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    logger.remove()
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,65 @@
+import base64
+import time
+from typing import Iterator, List, Tuple
+
+from langchain_core.messages import BaseMessage
+
+from app.services.llm import BaseChatModel
+from app.services.vision_model import VisualModel
+
+
+def make_story(words: int = 800, placeholders: int = 2) -> str:
+    tokens = [f"word{i}" for i in range(words)]
+    step = max(1, words // (placeholders + 1))
+    for p in range(placeholders):
+        tokens.insert((p + 1) * step + p, f"[a picture of scene {p}]")
+    return " ".join(tokens)
+
+
+class FakeChatModel(BaseChatModel):
+    def __init__(
+        self,
+        latency: float = 0.0,
+        chunk_latency: float = 0.0,
+        words: int = 800,
+        placeholders: int = 2,
+    ):
+        super().__init__("Fake")
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.story = make_story(words=words, placeholders=placeholders)
+
+    def get_available_models(self) -> List[Tuple]:
+        return [("1", "fake", "")]
+
+    def invoke(self, model_name: str, prompt: str, labels: dict = None) -> BaseMessage:
+        time.sleep(self.latency)
+        return BaseMessage(content=self.story, type="str")
+
+    def stream(
+        self, model_name: str, prompt: str, labels: dict = None
+    ) -> Iterator[str]:
+        time.sleep(self.latency)
+        for word in self.story.split(" "):
+            time.sleep(self.chunk_latency)
+            yield word + " "
+
+
+class FakeVisualModel(VisualModel):
+    def __init__(self, latency: float = 0.0, image_bytes: int = 50_000):
+        super().__init__("Fake")
+        self.latency = latency
+        self.image_bytes = image_bytes
+
+    def generate_images(
+        self, prompts: list[str], iterations: int = 1
+    ) -> dict[str, str]:
+        # images are generated concurrently by the real backends, so a batch
+        # takes as long as a single image
+        time.sleep(self.latency)
+        return {p: self.make_image(p) for p in prompts}
+
+    def make_image(self, prompt: str) -> str:
+        seed = prompt.encode("utf-8")
+        data = (seed * (self.image_bytes // max(1, len(seed)) + 1))[: self.image_bytes]
+        return base64.b64encode(data).decode("ascii")
@@ -0,0 +1,308 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+from app.services.placeholders import PlaceholderParser
+from app.services.prompt_budget import get_encoding
+from app.services.storyteller import StoryTeller
+from benchmarks.fakes import FakeChatModel, FakeVisualModel, make_story
+
+
+def measure(fn: Callable, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+def bench_tell(scale: float) -> tuple[Callable, dict]:
+    latency = 0.05
+    story_teller = StoryTeller(
+        llm=FakeChatModel(latency=latency),
+        visionModel=FakeVisualModel(latency=latency),
+    )
+
+    def run():
+        story_teller.tell(
+            original_content=make_story(words=int(2000 * scale), placeholders=0),
+            model_name="fake",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+
+    return run, {"llm_latency": latency, "image_latency": latency}
+
+
+def bench_tell_variants(scale: float) -> tuple[Callable, dict]:
+    latency = 0.05
+    story_teller = StoryTeller(
+        llm=FakeChatModel(latency=latency),
+        visionModel=FakeVisualModel(latency=latency),
+    )
+    variants = [
+        (language, from_year, from_year + 2)
+        for language in ("german", "english")
+        for from_year in (5, 8)
+    ]
+
+    def run():
+        story_teller.tell_variants(
+            original_content=make_story(words=int(2000 * scale), placeholders=0),
+            model_name="fake",
+            audience="children",
+            variants=variants,
+        )
+
+    return run, {
+        "llm_latency": latency,
+        "image_latency": latency,
+        "variants": len(variants),
+    }
+
+
+def bench_tell_stream(scale: float) -> tuple[Callable, dict]:
+    story_teller = StoryTeller(
+        llm=FakeChatModel(latency=0.05, chunk_latency=0.0005),
+        visionModel=FakeVisualModel(latency=0.05),
+    )
+
+    def run():
+        stream = story_teller.tell_stream(
+            original_content="pharaohs",
+            model_name="fake",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+        for _ in stream:
+            pass
+
+    return run, {"llm_latency": 0.05, "chunk_latency": 0.0005}
+
+
+def bench_extract_placeholders(scale: float) -> tuple[Callable, dict]:
+    words = int(100_000 * scale)
+    placeholders = int(1_000 * scale)
+    story = make_story(words=words, placeholders=placeholders)
+    return (lambda: StoryTeller.extract_placeholders_from_text(story)), {
+        "words": words,
+        "placeholders": placeholders,
+    }
+
+
+def bench_transform_text_to_html(scale: float) -> tuple[Callable, dict]:
+    words = int(10_000 * scale)
+    placeholders = int(50 * scale)
+    story = make_story(words=words, placeholders=placeholders)
+    vision_model = FakeVisualModel(image_bytes=500_000)
+    images = vision_model.generate_images(
+        StoryTeller.extract_placeholders_from_text(story)
+    )
+    story_teller = StoryTeller(llm=FakeChatModel(), visionModel=vision_model)
+    return (
+        lambda: story_teller.transform_text_to_html(story, images, model_name="fake")
+    ), {"words": words, "images": len(images), "image_bytes": 500_000}
+
+
+def bench_transform_text_to_html_many_placeholders(
+    scale: float,
+) -> tuple[Callable, dict]:
+    words = int(100_000 * scale)
+    placeholders = int(1_000 * scale)
+    story = make_story(words=words, placeholders=placeholders)
+    vision_model = FakeVisualModel(image_bytes=1_000)
+    images = vision_model.generate_images(
+        StoryTeller.extract_placeholders_from_text(story)
+    )
+    story_teller = StoryTeller(llm=FakeChatModel(), visionModel=vision_model)
+    return (
+        lambda: story_teller.transform_text_to_html(story, images, model_name="fake")
+    ), {"words": words, "images": len(images), "image_bytes": 1_000}
+
+
+def bench_placeholder_parser(scale: float) -> tuple[Callable, dict]:
+    words = int(100_000 * scale)
+    placeholders = int(1_000 * scale)
+    story = make_story(words=words, placeholders=placeholders)
+    chunk_size = 16
+    chunks = [story[i : i + chunk_size] for i in range(0, len(story), chunk_size)]
+
+    def run():
+        parser = PlaceholderParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+
+    return run, {
+        "words": words,
+        "placeholders": placeholders,
+        "chunk_size": chunk_size,
+    }
+
+
+def bench_get_content_from_plain_text_file(scale: float) -> tuple[Callable, dict]:
+    directory = tempfile.mkdtemp()
+    path = Path(directory) / "lesson.txt"
+    paragraph = make_story(words=200, placeholders=0)
+    paragraphs = int(5_000 * scale)
+    path.write_text("\n\n".join(paragraph for _ in range(paragraphs)))
+    size = path.stat().st_size
+    return (lambda: StoryTeller.get_content_from_plain_text_file(str(path))), {
+        "file_bytes": size,
+        # without a cached tiktoken encoding the tokens are estimated
+        "exact_tokens": get_encoding("cl100k_base") is not None,
+    }
+
+
+BENCHMARKS = {
+    "tell": bench_tell,
+    "tell_variants": bench_tell_variants,
+    "tell_stream": bench_tell_stream,
+    "extract_placeholders_from_text": bench_extract_placeholders,
+    "transform_text_to_html": bench_transform_text_to_html,
+    "transform_text_to_html_many_placeholders": bench_transform_text_to_html_many_placeholders,
+    "placeholder_parser": bench_placeholder_parser,
+    "get_content_from_plain_text_file": bench_get_content_from_plain_text_file,
+}
+
+
+def with_throughput(result: dict) -> dict:
+    file_bytes = result.get("parameters", {}).get("file_bytes")
+    if file_bytes is not None and result["median"] > 0:
+        result["megabytes_per_second"] = file_bytes / result["median"] / 1e6
+    return result
+
+
+# lit.main renders the page once imported, so the modules it pulls in stand in
+# for the streamlit app
+IMPORT_PROFILE_MODULES = [
+    "app.services.storyteller",
+    "app.services.jobs",
+    "app.services.routing",
+    "app.services.model_catalog",
+    "app.warmup",
+    "app.batch",
+    "app.api",
+]
+
+
+def import_profile(modules: list[str] = IMPORT_PROFILE_MODULES, top: int = 10) -> dict:
+    profile = {}
+    for module in modules:
+        # a fresh interpreter, so nothing is imported by the benchmarks before
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent.parent,
+        )
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()
+            profile[module] = {"skipped": error[-1] if error else "failed"}
+            continue
+        children: dict[str, float] = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            # the indentation after the separator is the nesting of the import
+            name = name[1:]
+            seconds = int(cumulative) / 1e6
+            if not name.startswith(" "):
+                if name.strip() == module:
+                    profile[module] = {
+                        "seconds": seconds,
+                        "imports": dict(
+                            sorted(children.items(), key=lambda i: -i[1])[:top]
+                        ),
+                    }
+                children = {}
+            elif not name.startswith("   "):
+                children[name.strip()] = seconds
+    return profile
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(names: list[str], repeat: int = 5, scale: float = 1.0) -> dict:
+    results = {}
+    for name in names:
+        logger.info(f"running benchmark {name}")
+        try:
+            fn, parameters = BENCHMARKS[name](scale)
+            fn()  # warm up caches and lazy imports
+            results[name] = with_throughput(
+                {"parameters": parameters, **measure(fn, repeat)}
+            )
+        except ImportError as e:
+            # only a missing optional backend skips a benchmark, any other
+            # failure is a bug the run must not hide
+            logger.warning(f"benchmark {name} skipped due to {e!r}")
+            results[name] = {"skipped": repr(e)}
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": scale,
+        "benchmarks": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the StoryTeller benchmarks")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiplier for the input sizes"
+    )
+    parser.add_argument(
+        "--skip-imports", action="store_true", help="skip the import time profile"
+    )
+    parser.add_argument(
+        "benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all)"
+    )
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO", filter="benchmarks")
+    result = run(
+        args.benchmarks or list(BENCHMARKS), repeat=args.repeat, scale=args.scale
+    )
+    if not args.skip_imports:
+        result["imports"] = import_profile()
+    Path(args.output).write_text(json.dumps(result, indent=2))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
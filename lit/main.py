@@ -1,12 +1,23 @@
+import threading
 import time
+from pathlib import Path
 from typing import List
 
 import streamlit as st
-import markdown
 
+from app.helper.env_helper import config
+from app.services.cache import Cache
+from app.services.condenser import DocumentCondenser
+from app.services.image_scheduler import ImageScheduler
+from app.services.image_store import ImageStore
+from app.services.jobs import JobQueue, RedisJobStore, story_job
 from app.services.llm import OllamaChatModel, NvidiaFoundationChatModel, BaseChatModel
+from app.services.metrics import start_metrics_server
+from app.services.model_catalog import ModelCatalog
+from app.services.routing import Route, RoutingChatModel
 from app.services.storyteller import StoryTeller
 from app.services.vision_model import NvidiaFoundationVisionModel
+from app.warmup import warm_up
 from loguru import logger
 
 placeholder = """
@@ -37,27 +48,130 @@ st.markdown(
 )
 
 
-@st.cache_data
+FALLBACK_MODEL_NAMES = {
+    "meta/llama3-70b-instruct": "llama3:latest",
+    "microsoft/phi-3-medium-4k-instruct": "phi3:medium",
+    "google/gemma-7b": "gemma:7b",
+}
+
+
+@st.cache_resource
+def init_cache() -> Cache:
+    return Cache(
+        path=config.get("CACHE_PATH", ".cache/learntales.sqlite"),
+        max_size_bytes=int(config.get("CACHE_MAX_SIZE_BYTES", 512 * 1024 * 1024)),
+        ttl=float(config.get("CACHE_TTL_SECONDS", 30 * 24 * 60 * 60)),
+    )
+
+
+@st.cache_resource
+def init_image_store() -> ImageStore:
+    # files below lit/static are served by streamlit under app/static
+    return ImageStore(
+        directory=str(Path(__file__).parent / "static" / "images"),
+        url_prefix="app/static/images",
+        target_width=int(config.get("IMAGE_TARGET_WIDTH", 300)),
+    )
+
+
+@st.cache_resource
+def init_job_queue() -> JobQueue:
+    # shared by all sessions, so the limits hold across users
+    redis_url = config.get("REDIS_URL")
+    return JobQueue(
+        workers=int(config.get("JOB_WORKERS", 4)),
+        limits={
+            "Ollama": int(config.get("OLLAMA_CONCURRENCY", 1)),
+            "Nvidia Foundation": int(config.get("NVIDIA_CONCURRENCY", 4)),
+            "Routing": int(config.get("NVIDIA_CONCURRENCY", 4)),
+        },
+        store=RedisJobStore(redis_url) if redis_url else None,
+    )
+
+
+@st.cache_resource
+def init_model_catalog() -> ModelCatalog:
+    # shared by all sessions, so the endpoints are not queried on every rerun
+    return ModelCatalog(ttl=float(config.get("MODEL_CATALOG_TTL_SECONDS", 10 * 60)))
+
+
+@st.cache_resource
+def init_ollama() -> OllamaChatModel:
+    # does not depend on the api key, so its clients survive a key change
+    return OllamaChatModel(
+        base_url=config.get("OLLAMA_BASE_URL", "http://localhost:11434")
+    )
+
+
+@st.cache_resource
 def init_models(api_key: str | None = None, debug: bool = False):
     logger.info("loading the models")
     logger.info(api_key)
 
     llm = NvidiaFoundationChatModel(api_key=api_key if api_key is not None else "")
+    ollama = init_ollama()
     if debug:
-        llm = OllamaChatModel()
+        llm = ollama
+    elif config.get("OLLAMA_FALLBACK", "false").lower() == "true":
+        # the local models take over when the nvidia endpoint is slow or down
+        llm = RoutingChatModel(
+            [
+                Route(llm),
+                Route(
+                    ollama,
+                    weight=float(config.get("OLLAMA_WEIGHT", 0)),
+                    model_names=FALLBACK_MODEL_NAMES,
+                ),
+            ],
+            hedge=config.get("HEDGE_REQUESTS", "false").lower() == "true",
+        )
 
-    vision_model = NvidiaFoundationVisionModel(
-        api_key=api_key if api_key is not None else ""
+    # previews keep the story fast, the final images are drawn in the background
+    vision_model = ImageScheduler(
+        NvidiaFoundationVisionModel(
+            api_key=api_key if api_key is not None else "", cache=init_cache()
+        ),
+        latency_budget=float(config.get("IMAGE_LATENCY_BUDGET_SECONDS", 3)),
+        refine=config.get("REFINE_IMAGES", "false").lower() == "true",
     )
     return llm, vision_model
 
 
+@st.cache_resource
+def init_metrics_server():
+    port = config.get("METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+
+@st.cache_resource
+def init_warm_up(
+    _llm: BaseChatModel, _vision_model, api_key: str | None, debug: bool
+) -> threading.Thread:
+    # runs once per process and model setup while the first page is rendered
+    model_names = (
+        list(FALLBACK_MODEL_NAMES.values()) if debug else list(FALLBACK_MODEL_NAMES)
+    )
+    has_key = api_key is not None or not _llm.is_api_key_needed()
+    thread = threading.Thread(
+        target=warm_up,
+        kwargs=dict(
+            model_names=model_names,
+            llm=_llm if has_key else None,
+            vision_model=_vision_model if has_key else None,
+        ),
+        name="warm-up",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
 def get_model_options(_llm: BaseChatModel, api_key: str | None) -> List[str]:
     logger.info("getting llm models")
     if _llm.is_api_key_needed() and api_key is None:
         return []
 
-    models = list({llm[1] for llm in _llm.get_available_models()})
+    models = list({llm[1] for llm in init_model_catalog().get(_llm)})
     return models
 
 
@@ -91,24 +205,75 @@ def tell_me():
     language = st.session_state.language
     from_year, to_year = st.session_state.target_age
 
-    story_teller = StoryTeller(visionModel=visionModel, llm=llm)
-    original_content = content
-    story = story_teller.tell(
-        original_content=original_content,
+    story_teller = StoryTeller(
+        visionModel=visionModel,
+        llm=llm,
+        cache=init_cache(),
+        condenser=DocumentCondenser(llm=llm, cache=init_cache()),
+        condense=st.session_state.get("long_document", True),
+        image_store=init_image_store(),
+    )
+    story = dict(
+        original_content=content,
         model_name=model_name,
         audience="children",
         from_year=from_year,
         to_year=to_year,
         language=language,
     )
-    st.session_state.story = story
+    st.session_state.job_id = init_job_queue().submit(
+        story_teller.get_story_cache_key(**story),
+        story_job(story_teller, **story),
+        backend=llm.name[0],
+    )
     st.session_state.content = None
-    st.balloons()
 
 
-if "story_generation" in st.session_state and st.session_state["story_generation"]:
+def cancel_job():
+    init_job_queue().cancel(st.session_state.job_id)
+    st.session_state.job_id = None
+    reset()
+
+
+@st.experimental_fragment(run_every=1)
+def show_job_progress():
+    job = init_job_queue().status(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        reset()
+        st.rerun()
+    if job["status"] in ("queued", "running"):
+        progress = job["progress"]
+        if job["status"] == "queued":
+            st.caption("Waiting for a free storyteller...")
+        if progress["images_total"] > 0:
+            st.progress(
+                progress["images_done"] / progress["images_total"],
+                text=f"Images {progress['images_done']}/{progress['images_total']}",
+            )
+        st.markdown(progress["text"])
+        st.button("Cancel", on_click=cancel_job)
+        return
+
+    st.session_state.job_id = None
+    if job["status"] == "done":
+        st.session_state.story = job["result"]
+        st.session_state.trace = job["progress"].get("trace")
+        st.balloons()
+    else:
+        st.session_state["story_generation"] = False
+        st.session_state.job_error = job["error"] or job["status"]
+    st.rerun()
+
+
+if st.session_state.get("job_id") is not None:
+    show_job_progress()
+elif "story_generation" in st.session_state and st.session_state["story_generation"]:
     logger.info("Generating story")
 else:
+    if st.session_state.get("job_error") is not None:
+        st.error(f"The story could not be told: {st.session_state.job_error}")
+        st.session_state.job_error = None
     st.title("LearnTales")
     st.write(intro_text)
     st.text_area(
@@ -133,9 +298,32 @@ with st.sidebar:
         api_key=api_key,
         debug=st.session_state["debug"] if "debug" in st.session_state else False,
     )
+    init_metrics_server()
+    init_warm_up(
+        llm,
+        visionModel,
+        api_key=api_key,
+        debug=st.session_state["debug"] if "debug" in st.session_state else False,
+    )
     model_options = get_model_options(_llm=llm, api_key=api_key)
     st.image("./assets/cover.jpeg", width=150)
     st.checkbox(label="Debug with (Ollama)", key="debug")
+    if st.session_state.get("debug"):
+        st.caption("Cache hits and misses")
+        st.json(init_cache().stats(), expanded=False)
+        if isinstance(llm, RoutingChatModel):
+            st.caption("Backend health")
+            st.json(llm.health(), expanded=False)
+        if st.session_state.get("trace") is not None:
+            trace = st.session_state.trace
+            with st.expander(f"Last story took {trace['total_seconds']:.2f}s"):
+                st.table(
+                    {
+                        "stage": list(trace["stages"]),
+                        "seconds": [round(s, 3) for s in trace["stages"].values()],
+                    }
+                )
+                st.json({"tokens": trace["tokens"], "images": trace["images"]})
     st.markdown(
         "Idea of generating small engaging stories with informational content for micro learning"
     )
@@ -146,6 +334,13 @@ with st.sidebar:
     target_language = st.selectbox(
         "Language", options=["german", "english"], key="language"
     )
+    st.checkbox(
+        label="Condense long documents",
+        key="long_document",
+        value=True,
+        help="Summarizes content that exceeds the model context before telling the story, "
+        "otherwise it is cut off",
+    )
     from_age, to_age = st.select_slider(
         "Age",
         key="target_age",
@@ -155,5 +350,6 @@ with st.sidebar:
     st.markdown("Powered by Nvidia")
 
 if "story" in st.session_state and st.session_state.story is not None:
-    st.markdown(markdown.markdown(st.session_state.story), unsafe_allow_html=True)
+    # the story is already sanitized html
+    st.markdown(st.session_state.story, unsafe_allow_html=True)
     st.button("Tell me a new story", on_click=reset)
@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+from app import api
+
+
+class TestBatchApi(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        story_teller = MagicMock()
+        story_teller.tell.return_value = "<p>story</p>"
+        patchers = [
+            patch.object(api, "get_story_teller", return_value=story_teller),
+            patch.dict(api.config, {"BATCH_OUTPUT_DIR": self.output_dir.name}),
+            patch.dict(api.batches, clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = TestClient(api.app)
+
+    def test_files_and_internal_urls_are_rejected(self):
+        for lesson in [
+            {"file": "/etc/passwd"},
+            {"url": "http://127.0.0.1:8000/internal"},
+            {"url": "https://no-such-host.invalid/page"},
+        ]:
+            response = self.client.post("/batches", json={"lessons": [lesson]})
+
+            self.assertEqual(response.status_code, 422)
+
+        response = self.client.post(
+            "/batches", json={"id": "../../tmp", "lessons": [{"content": "x"}]}
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_resubmitted_batches_resume_in_the_same_folder(self):
+        batch = {"lessons": [{"id": "nile", "content": "the nile"}]}
+
+        first = self.client.post("/batches", json=batch).json()
+        second = self.client.post("/batches", json=batch).json()
+
+        self.assertEqual(first, second)
+        self.assertTrue(
+            (Path(self.output_dir.name) / first["id"] / "nile" / "story.html").exists()
+        )
+        self.assertEqual(
+            self.client.get(f"/batches/{first['id']}").json()["skipped"], 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from app.batch import BatchRunner, Lesson, load_manifest
+from app.helper.rate_limit import RateLimiter
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        self.story_teller = MagicMock()
+        self.story_teller.tell.side_effect = (
+            lambda original_content, **kwargs: f"<p>{original_content}</p>"
+        )
+        self.lessons = [
+            Lesson(id="pharaoh", content="pharaohs"),
+            Lesson(id="nile", content="the nile", language="english"),
+        ]
+
+    def test_run_writes_stories_and_checkpoints(self):
+        runner = BatchRunner(self.story_teller, self.output_dir.name, workers=2)
+
+        progress = runner.run(self.lessons)
+
+        output_dir = Path(self.output_dir.name)
+        self.assertEqual(progress["done"], 2)
+        self.assertEqual(
+            (output_dir / "pharaoh" / "story.html").read_text(), "<p>pharaohs</p>"
+        )
+        self.assertEqual(runner.completed_ids(), {"pharaoh", "nile"})
+        folders = {
+            c.kwargs["original_content"]: c.kwargs["output_folder_path"]
+            for c in self.story_teller.tell.call_args_list
+        }
+        self.assertEqual(folders["pharaohs"], str(output_dir / "pharaoh"))
+
+    def test_run_resumes_after_failures(self):
+        self.story_teller.tell.side_effect = [RuntimeError("gpu on fire"), "<p>ok</p>"]
+        runner = BatchRunner(self.story_teller, self.output_dir.name, workers=1)
+
+        progress = runner.run(self.lessons)
+
+        self.assertEqual((progress["done"], progress["failed"]), (1, 1))
+
+        self.story_teller.tell.side_effect = None
+        self.story_teller.tell.return_value = "<p>retry</p>"
+        progress = runner.run(self.lessons)
+
+        self.assertEqual((progress["done"], progress["skipped"]), (1, 1))
+        self.assertEqual(runner.completed_ids(), {"pharaoh", "nile"})
+
+    def test_load_manifest(self):
+        jsonl = Path(self.output_dir.name) / "lessons.jsonl"
+        jsonl.write_text(
+            json.dumps({"content": "pharaohs", "from_year": 8, "to_year": 10}) + "\n"
+        )
+        csv = Path(self.output_dir.name) / "lessons.csv"
+        csv.write_text("id,file,language\nnile,nile.txt,english\n")
+
+        from_jsonl = load_manifest(str(jsonl))
+        from_csv = load_manifest(str(csv))
+
+        self.assertEqual((from_jsonl[0].from_year, from_jsonl[0].to_year), (8, 10))
+        self.assertEqual(len(from_jsonl[0].get_id()), 16)
+        self.assertEqual(from_csv[0].file, "nile.txt")
+        self.assertEqual(from_csv[0].language, "english")
+
+    def test_lesson_ids_cannot_leave_the_output_dir(self):
+        for lesson_id in ["../escape", "a/b", "..", ".hidden", ""]:
+            with self.assertRaises(ValueError):
+                Lesson(id=lesson_id, content="pharaohs")
+
+        runner = BatchRunner(self.story_teller, self.output_dir.name, workers=1)
+        progress = runner.run([Lesson.model_construct(id="../escape", content="x")])
+
+        self.assertEqual(progress["failed"], 1)
+        self.assertFalse((Path(self.output_dir.name).parent / "escape").exists())
+        self.story_teller.tell.assert_not_called()
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_acquire_waits_for_tokens(self):
+        rate_limiter = RateLimiter(rate_per_second=20, burst=2)
+
+        start = time.perf_counter()
+        for _ in range(4):
+            rate_limiter.acquire()
+        elapsed = time.perf_counter() - start
+
+        self.assertGreaterEqual(elapsed, 0.09)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from benchmarks.fakes import FakeChatModel, FakeVisualModel, make_story
+from benchmarks.run import import_profile, run
+from app.services.storyteller import StoryTeller
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_make_story_is_deterministic(self):
+        story = make_story(words=30, placeholders=2)
+
+        self.assertEqual(story, make_story(words=30, placeholders=2))
+        self.assertEqual(
+            StoryTeller.extract_placeholders_from_text(story),
+            ["a picture of scene 0", "a picture of scene 1"],
+        )
+
+    def test_fakes_follow_the_model_interfaces(self):
+        llm = FakeChatModel(words=5, placeholders=0)
+        vision_model = FakeVisualModel(image_bytes=10)
+
+        self.assertEqual(
+            llm.invoke("fake", "prompt").content, "word0 word1 word2 word3 word4"
+        )
+        self.assertEqual("".join(llm.stream("fake", "prompt")).strip(), llm.story)
+        self.assertEqual(list(vision_model.generate_images(["a", "b"])), ["a", "b"])
+
+    def test_run_reports_timings(self):
+        result = run(["extract_placeholders_from_text"], repeat=2, scale=0.01)
+
+        benchmark = result["benchmarks"]["extract_placeholders_from_text"]
+        self.assertEqual(benchmark["repeat"], 2)
+        self.assertLessEqual(benchmark["min"], benchmark["max"])
+        self.assertEqual(benchmark["parameters"]["words"], 1000)
+
+    def test_run_only_skips_missing_imports(self):
+        def missing(scale):
+            raise ImportError("No module named 'unstructured'")
+
+        def broken(scale):
+            raise ValueError("broken")
+
+        with patch.dict("benchmarks.run.BENCHMARKS", missing=missing, broken=broken):
+            result = run(["missing"], repeat=1)
+            self.assertIn("ImportError", result["benchmarks"]["missing"]["skipped"])
+            with self.assertRaises(ValueError):
+                run(["broken"], repeat=1)
+
+    def test_import_profile_reports_the_slowest_imports(self):
+        profile = import_profile(["json", "not_a_module"], top=1)
+
+        self.assertGreater(profile["json"]["seconds"], 0)
+        self.assertEqual(len(profile["json"]["imports"]), 1)
+        self.assertIn("ModuleNotFoundError", profile["not_a_module"]["skipped"])
+
+
+if __name__ == "__main__":
+    unittest.main()
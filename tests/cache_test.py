@@ -0,0 +1,60 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from app.services.cache import Cache
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache(path=":memory:", max_size_bytes=10, ttl=60)
+
+    def test_make_key_is_stable(self):
+        self.assertEqual(
+            Cache.make_key("llama3", 5, 7, "german"),
+            Cache.make_key("llama3", 5, 7, "german"),
+        )
+        self.assertNotEqual(
+            Cache.make_key("llama3", 5, 7, "german"),
+            Cache.make_key("llama3", 5, 7, "english"),
+        )
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("story", "a"))
+        self.cache.set("story", "a", "once")
+        self.assertEqual(self.cache.get("story", "a"), "once")
+        self.assertIsNone(self.cache.get("image", "a"))
+
+        self.assertEqual(
+            self.cache.stats(),
+            {
+                "image": {"hits": 0, "misses": 1, "entries": 0, "size_bytes": 0},
+                "story": {"hits": 1, "misses": 1, "entries": 1, "size_bytes": 4},
+            },
+        )
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.set("image", "a", "aaaa")
+        time.sleep(0.01)
+        self.cache.set("image", "b", "bbbb")
+        time.sleep(0.01)
+        self.cache.get("image", "a")
+        self.cache.set("image", "c", "cccc")
+
+        self.assertEqual(self.cache.get("image", "a"), "aaaa")
+        self.assertIsNone(self.cache.get("image", "b"))
+        self.assertEqual(self.cache.get("image", "c"), "cccc")
+
+    def test_expired_entries_are_misses(self):
+        self.cache.set("story", "a", "once")
+        with patch("app.services.cache.time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get("story", "a"))
+        self.assertEqual(self.cache.stats()["story"]["entries"], 0)
+
+    def test_values_larger_than_the_cache_are_skipped(self):
+        self.cache.set("image", "a", "a" * 11)
+        self.assertIsNone(self.cache.get("image", "a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
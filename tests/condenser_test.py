@@ -0,0 +1,78 @@
+import hashlib
+import unittest
+from unittest.mock import MagicMock
+
+from app.services.condenser import DocumentCondenser
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+class TestDocumentCondenser(unittest.TestCase):
+    def setUp(self):
+        self.llm = MagicMock()
+        self.llm.invoke.side_effect = lambda model_name, prompt: MagicMock(
+            content=f"summary {hashlib.md5(prompt.encode()).hexdigest()[:6]}"
+        )
+        self.condenser = DocumentCondenser(
+            llm=self.llm,
+            chunk_tokens=5,
+            summary_tokens=2,
+            reduce_tokens=4,
+            brief_tokens=4,
+            token_counter=count_words,
+        )
+
+    def test_short_content_is_not_condensed(self):
+        result = self.condenser.condense_text("pharaohs ruled egypt", "llama3")
+
+        self.assertEqual(result, "pharaohs ruled egypt")
+        self.llm.invoke.assert_not_called()
+
+    def test_chunks_are_reduced_hierarchically(self):
+        chunks = [f"chunk{i} about the pharaoh" for i in range(8)]
+
+        result = self.condenser.condense(chunks, "llama3")
+
+        self.assertLessEqual(count_words(result), 4)
+        # 8 map calls, then 4 and 2 reduce calls
+        self.assertEqual(self.llm.invoke.call_count, 8 + 4 + 2)
+
+    def test_chunk_summaries_are_memoized(self):
+        chunks = [f"chunk{i} about the pharaoh" for i in range(4)]
+        self.condenser.condense(chunks, "llama3")
+        self.llm.invoke.reset_mock()
+
+        chunks[3] = "edited chunk about the pyramids"
+        self.condenser.condense(chunks, "llama3")
+
+        prompts = [c.kwargs["prompt"] for c in self.llm.invoke.call_args_list]
+        map_prompts = [p for p in prompts if "about the" in p]
+        self.assertEqual(len(map_prompts), 1)
+        self.assertIn("edited chunk", map_prompts[0])
+
+    def test_condense_text_splits_by_token_budget(self):
+        content = "\n\n".join(f"part{i} of the lesson" for i in range(6))
+
+        self.condenser.condense_text(content, "llama3")
+
+        map_prompts = [
+            c.kwargs["prompt"]
+            for c in self.llm.invoke.call_args_list
+            if "of the lesson" in c.kwargs["prompt"]
+        ]
+        self.assertEqual(len(map_prompts), 6)
+
+    def test_documents_without_blank_lines_are_split(self):
+        content = " ".join(f"word{i}" for i in range(23)) + "\nlast line"
+
+        chunks = self.condenser.split(content)
+
+        self.assertEqual(len(chunks), 6)
+        self.assertTrue(all(count_words(chunk) <= 5 for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), content.split())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from app.helper.html_helper import markdown_to_html, sanitize_html
+
+
+class TestHtmlHelper(unittest.TestCase):
+    def test_allowed_tags_are_kept(self):
+        self.assertEqual(
+            sanitize_html("<p>Once <strong>upon</strong><br> a time</p>"),
+            "<p>Once <strong>upon</strong><br> a time</p>",
+        )
+
+    def test_unknown_tags_and_attributes_are_removed(self):
+        self.assertEqual(
+            sanitize_html(
+                "<div class='x'><p onclick='x()'>Hi <a href='javascript:x()'>a</a>"
+                "<a href='https://example.org'>b</a></p></div>"
+            ),
+            '<p>Hi <a>a</a><a href="https://example.org">b</a></p>',
+        )
+
+    def test_scripts_are_dropped_and_text_is_escaped(self):
+        self.assertEqual(
+            sanitize_html("<p>1 < 2 & <script>alert('x')</script>3</p>"),
+            "<p>1 &lt; 2 &amp; 3</p>",
+        )
+
+    def test_unbalanced_tags_are_closed(self):
+        self.assertEqual(
+            sanitize_html("<p><em>Once</p></strong> upon<ul><li>a"),
+            "<p><em>Once</em></p> upon<ul><li>a</li></ul>",
+        )
+
+    def test_markdown_is_converted(self):
+        self.assertEqual(
+            markdown_to_html("# Pharaohs\n\nThey **ruled** egypt."),
+            "<h1>Pharaohs</h1>\n<p>They <strong>ruled</strong> egypt.</p>",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from app.services.image_scheduler import ImageScheduler, QualityTier
+from app.services.storyteller import StoryTeller
+from app.services.vision_model import VisualModel
+
+TIERS = [
+    QualityTier("preview", steps=1, seconds=0.1),
+    QualityTier("final", steps=8, seconds=1.0),
+]
+
+
+class FakeVisualModel(VisualModel):
+    def __init__(self, latency: float = 0.0, max_batch_size: int | None = None):
+        super().__init__("Fake")
+        self.latency = latency
+        self.max_batch_size = max_batch_size
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate_images(
+        self, prompts: list[str], iterations: int = 1
+    ) -> dict[str, str]:
+        self.calls.append((list(prompts), iterations))
+        if iterations > 1:
+            self.release.wait()
+        time.sleep(self.latency)
+        return {p: f"{p}@{iterations}" for p in prompts}
+
+
+class TestImageScheduler(unittest.TestCase):
+    def test_near_identical_prompts_are_drawn_once(self):
+        vision_model = FakeVisualModel()
+        scheduler = ImageScheduler(vision_model, tiers=TIERS)
+
+        images = scheduler.generate_images(["a cat", "A cat!", "the dog"])
+
+        self.assertEqual(vision_model.calls, [(["a cat", "the dog"], 8)])
+        self.assertEqual(
+            images, {"a cat": "a cat@8", "A cat!": "a cat@8", "the dog": "the dog@8"}
+        )
+
+    def test_prompts_are_split_into_batches(self):
+        vision_model = FakeVisualModel(max_batch_size=2)
+        scheduler = ImageScheduler(vision_model, tiers=TIERS)
+
+        images = scheduler.generate_images(["a", "b", "c", "d", "e"])
+
+        self.assertEqual(len(images), 5)
+        self.assertEqual(
+            sorted(prompts for prompts, _ in vision_model.calls),
+            [["a", "b"], ["c", "d"], ["e"]],
+        )
+
+    def test_tier_is_chosen_by_latency_budget(self):
+        scheduler = ImageScheduler(FakeVisualModel(), tiers=TIERS, latency_budget=0.5)
+
+        self.assertEqual(scheduler.choose_tier().name, "preview")
+        self.assertEqual(scheduler.choose_tier(latency_budget=2).name, "final")
+        self.assertEqual(scheduler.choose_tier(latency_budget=0.01).name, "preview")
+
+    def test_measured_latency_moves_the_tier(self):
+        scheduler = ImageScheduler(
+            FakeVisualModel(latency=0.05), tiers=TIERS, latency_budget=0.5, alpha=1.0
+        )
+        scheduler._latency["final"] = 0.0
+
+        scheduler.generate_images(["a cat"])
+
+        self.assertAlmostEqual(scheduler._latency["final"], 0.05, delta=0.04)
+        self.assertEqual(scheduler.choose_tier().name, "final")
+
+    def test_latency_is_measured_per_request(self):
+        scheduler = ImageScheduler(
+            FakeVisualModel(latency=0.05, max_batch_size=1),
+            tiers=TIERS,
+            alpha=1.0,
+            max_workers=1,
+        )
+
+        scheduler.generate_images(["a", "b", "c", "d"])
+
+        self.assertAlmostEqual(scheduler._latency["final"], 0.05, delta=0.04)
+
+    def test_next_better_tier_is_probed(self):
+        vision_model = FakeVisualModel()
+        scheduler = ImageScheduler(
+            vision_model, tiers=TIERS, latency_budget=0.5, alpha=1.0, probe_every=2
+        )
+        scheduler._latency["final"] = 10.0
+
+        scheduler.generate_images(["a cat"])
+        scheduler.generate_images(["a dog"])
+
+        self.assertEqual([steps for _, steps in vision_model.calls], [1, 8])
+        self.assertEqual(scheduler.choose_tier().name, "final")
+
+    def test_refinement_does_not_block_previews(self):
+        vision_model = FakeVisualModel(max_batch_size=1)
+        vision_model.release.clear()
+        scheduler = ImageScheduler(
+            vision_model, tiers=TIERS, latency_budget=0.5, refine=True, max_workers=1
+        )
+        self.addCleanup(vision_model.release.set)
+
+        scheduler.generate_images(["a cat"])
+        images = scheduler.generate_images(["a dog", "a pyramid"])
+
+        self.assertEqual(images, {"a dog": "a dog@1", "a pyramid": "a pyramid@1"})
+
+    def test_previews_are_refined_in_the_background(self):
+        vision_model = FakeVisualModel()
+        vision_model.release.clear()
+        scheduler = ImageScheduler(
+            vision_model, tiers=TIERS, latency_budget=0.5, refine=True
+        )
+        refined = []
+
+        images = scheduler.generate_images(
+            ["a cat"], on_refined=lambda p, i: refined.append((p, i))
+        )
+        scheduler.generate_images(
+            ["A cat"], on_refined=lambda p, i: refined.append((p, i))
+        )
+        self.assertEqual(images, {"a cat": "a cat@1"})
+        self.assertEqual(refined, [])
+
+        vision_model.release.set()
+        self.assertTrue(scheduler.wait(timeout=1))
+
+        self.assertEqual(refined, [("a cat", "a cat@8"), ("A cat", "a cat@8")])
+        self.assertEqual(
+            [call for call in vision_model.calls if call[1] == 8], [(["a cat"], 8)]
+        )
+        self.assertEqual(scheduler.generate_images(["the cat"]), {"the cat": "a cat@8"})
+
+    def test_failed_refinement_keeps_the_preview(self):
+        vision_model = MagicMock()
+        vision_model.max_batch_size = None
+        vision_model.generate_images.side_effect = [
+            {"a cat": "preview"},
+            ConnectionError("unavailable"),
+            {"a cat": "preview"},
+        ]
+        scheduler = ImageScheduler(
+            vision_model, tiers=TIERS, latency_budget=0.5, refine=True
+        )
+
+        self.assertEqual(scheduler.generate_images(["a cat"]), {"a cat": "preview"})
+        self.assertTrue(scheduler.wait(timeout=1))
+        scheduler.refine = False
+        self.assertEqual(scheduler.generate_images(["a cat"]), {"a cat": "preview"})
+
+    def test_refined_images_replace_the_saved_previews(self):
+        vision_model = FakeVisualModel()
+        vision_model.generate_images = lambda prompts, iterations=1: {
+            p: "cHJldmlldw==" if iterations == 1 else "ZmluYWw=" for p in prompts
+        }
+        scheduler = ImageScheduler(
+            vision_model, tiers=TIERS, latency_budget=0.5, refine=True
+        )
+        storyteller = StoryTeller(llm=MagicMock(), visionModel=scheduler)
+
+        with tempfile.TemporaryDirectory() as output_folder:
+            storyteller.generate_images_from_prompt(
+                ["a cat"], output_folder_path=output_folder, fake=False
+            )
+            self.assertTrue(scheduler.wait(timeout=1))
+
+            self.assertEqual((Path(output_folder) / "a_cat.jpg").read_bytes(), b"final")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import base64
+import io
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from app.services.image_store import ImageStore
+
+
+def make_image(width: int, height: int, color: str = "orange") -> str:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, format="JPEG")
+    return base64.b64encode(output.getvalue()).decode("ascii")
+
+
+class TestImageStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = ImageStore(directory=self.directory.name, target_width=150)
+
+    def test_put_is_content_addressed(self):
+        image = make_image(100, 100)
+
+        first = self.store.put(image)
+        second = self.store.put(image)
+        other = self.store.put(make_image(100, 100, color="blue"))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(self.store.url(first), f"app/static/images/{first}.jpg")
+
+    def test_put_downscales_to_target_width(self):
+        image_id = self.store.put(make_image(1024, 768))
+
+        with Image.open(io.BytesIO(self.store.get(image_id))) as stored:
+            self.assertEqual(stored.size, (150, 112))
+
+    def test_least_recently_used_images_are_evicted(self):
+        store = ImageStore(
+            directory=self.directory.name, target_width=None, max_size_bytes=1
+        )
+
+        first = store.put(make_image(10, 10))
+        second = store.put(make_image(10, 10, color="blue"))
+
+        self.assertIsNone(store.get(first))
+        self.assertIsNotNone(store.get(second))
+
+    def test_concurrent_puts_of_the_same_image(self):
+        image = make_image(400, 300)
+        for _ in range(10):
+            store = ImageStore(directory=tempfile.mkdtemp(dir=self.directory.name))
+            barrier = threading.Barrier(8)
+
+            def put():
+                barrier.wait()
+                return store.put(image)
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                image_ids = list(executor.map(lambda _: put(), range(8)))
+
+            self.assertEqual(len(set(image_ids)), 1)
+            self.assertIsNotNone(store.get(image_ids[0]))
+            self.assertEqual(list(store.directory.glob("*.tmp")), [])
+
+    def test_get_unknown_image(self):
+        self.assertIsNone(self.store.get("unknown"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from app.services.cache import Cache
+from app.services.ingestion import WebIngestor, check_public_url, parse_document
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+    delay = 0.0
+
+    def do_GET(self):
+        PageHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+        time.sleep(PageHandler.delay)
+        if self.path == "/missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{self.path}-v1"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = f"<html><body><p>page {self.path}</p></body></html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestWebIngestor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        PageHandler.requests = []
+        PageHandler.delay = 0.0
+        self.parsed = []
+
+        def parser(content: bytes, content_type: str | None) -> str:
+            self.parsed.append(content_type)
+            return (
+                content.decode()
+                .removeprefix("<html><body><p>")
+                .removesuffix("</p></body></html>")
+            )
+
+        self.ingestor = WebIngestor(cache=Cache(":memory:"), parser=parser)
+
+    def test_all_documents_are_combined_in_order(self):
+        urls = [f"{self.base_url}/a", f"{self.base_url}/missing", f"{self.base_url}/b"]
+
+        self.assertEqual(self.ingestor.load_text(urls), "page /a\n\npage /b")
+
+    def test_pages_are_revalidated_with_their_etag(self):
+        url = f"{self.base_url}/a"
+
+        self.assertEqual(self.ingestor.fetch(url), "page /a")
+        self.assertEqual(self.ingestor.fetch(url), "page /a")
+
+        self.assertEqual(PageHandler.requests, [("/a", None), ("/a", '"/a-v1"')])
+        self.assertEqual(self.parsed, ["text/html"])
+        self.assertEqual(self.ingestor.cache.stats()["page"]["hits"], 1)
+
+    def test_urls_are_fetched_in_parallel(self):
+        PageHandler.delay = 0.1
+        urls = [f"{self.base_url}/{i}" for i in range(8)]
+
+        start = time.perf_counter()
+        documents = self.ingestor.load(urls)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(documents, [f"page /{i}" for i in range(8)])
+        self.assertLess(elapsed, 8 * PageHandler.delay / 2)
+
+    def test_public_only_ingestor_refuses_internal_addresses(self):
+        ingestor = WebIngestor(
+            public_only=True, parser=lambda content, _: content.decode()
+        )
+
+        with self.assertRaises(ValueError):
+            ingestor.fetch(f"{self.base_url}/a")
+        self.assertEqual(PageHandler.requests, [])
+
+
+class TestParseDocument(unittest.TestCase):
+    def test_plain_text_is_not_parsed_as_html(self):
+        self.assertEqual(
+            parse_document(
+                "<p>caf\xe9</p>".encode("latin-1"), "text/plain; charset=ISO-8859-1"
+            ),
+            "<p>caf\xe9</p>",
+        )
+
+
+class TestCheckPublicUrl(unittest.TestCase):
+    def test_only_public_http_urls_pass(self):
+        for url in [
+            "file:///etc/passwd",
+            "http://127.0.0.1:8000/",
+            "http://localhost/admin",
+            "http://169.254.169.254/latest/meta-data/",
+            "http://10.0.0.1/",
+            "http:///no-host",
+        ]:
+            with self.assertRaises(ValueError):
+                check_public_url(url)
+        check_public_url("http://93.184.215.14/lesson")
+
+    def test_unresolvable_hosts_are_rejected(self):
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror("not known")):
+            with self.assertRaisesRegex(ValueError, "cannot be resolved"):
+                check_public_url("https://no-such-host.invalid/page")
+
+    def test_hosts_are_allow_listed(self):
+        with self.assertRaises(ValueError):
+            check_public_url("http://93.184.215.14/", allowed_hosts={"example.org"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,234 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from app.services.jobs import JobQueue, RedisJobStore, story_job
+from app.services.storyteller import StoryTeller
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def expire(self, key, seconds):
+        return key in self.values
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+    def decr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) - 1
+        return self.values[key]
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(workers=4, limits={"ollama": 1})
+        self.addCleanup(self.queue.shutdown)
+
+    def test_submit_runs_the_job(self):
+        job_id = self.queue.submit("pharaohs", lambda job: "<p>pharaohs</p>")
+
+        self.assertEqual(self.queue.get(job_id).wait(timeout=1), "<p>pharaohs</p>")
+        self.assertEqual(self.queue.status(job_id)["status"], "done")
+
+    def test_identical_jobs_in_flight_are_deduplicated(self):
+        release = threading.Event()
+        fn = MagicMock(side_effect=lambda job: release.wait(timeout=1) and "story")
+
+        first = self.queue.submit("pharaohs", fn)
+        second = self.queue.submit("pharaohs", fn)
+        release.set()
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.queue.get(first).wait(timeout=1), "story")
+        fn.assert_called_once()
+
+    def test_concurrency_is_limited_per_backend(self):
+        release = threading.Event()
+        running, max_running = [0], [0]
+        lock = threading.Lock()
+
+        def fn(job):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            release.wait(timeout=1)
+            with lock:
+                running[0] -= 1
+            return job.key
+
+        jobs = [self.queue.submit(f"story {i}", fn, backend="ollama") for i in range(3)]
+        other = self.queue.submit("other", lambda job: "other", backend="nvidia")
+
+        self.assertEqual(self.queue.get(other).wait(timeout=1), "other")
+        self.assertEqual(self.queue.status(jobs[2])["status"], "queued")
+        release.set()
+        for job_id in jobs:
+            self.queue.get(job_id).wait(timeout=1)
+
+        self.assertEqual(max_running[0], 1)
+        self.assertEqual(
+            [self.queue.status(j)["result"] for j in jobs],
+            ["story 0", "story 1", "story 2"],
+        )
+
+    def test_cancel_queued_and_running_jobs(self):
+        started, release = threading.Event(), threading.Event()
+
+        def fn(job):
+            started.set()
+            release.wait(timeout=1)
+            job.raise_if_cancelled()
+            return "story"
+
+        running = self.queue.submit("first", fn, backend="ollama")
+        queued = self.queue.submit("second", fn, backend="ollama")
+        self.assertTrue(started.wait(timeout=1))
+
+        self.assertTrue(self.queue.cancel(queued))
+        self.assertTrue(self.queue.cancel(running))
+        release.set()
+        self.queue.get(running).wait(timeout=1)
+
+        self.assertEqual(self.queue.status(queued)["status"], "cancelled")
+        self.assertEqual(self.queue.status(running)["status"], "cancelled")
+
+    def test_shared_jobs_are_only_cancelled_by_the_last_session(self):
+        release = threading.Event()
+
+        def fn(job):
+            release.wait(timeout=1)
+            job.raise_if_cancelled()
+            return "story"
+
+        job_id = self.queue.submit("pharaohs", fn)
+        self.assertEqual(self.queue.submit("pharaohs", fn), job_id)
+
+        self.assertFalse(self.queue.cancel(job_id))
+        self.assertFalse(self.queue.get(job_id).cancelled)
+        self.assertTrue(self.queue.cancel(job_id))
+        release.set()
+        self.queue.get(job_id).wait(timeout=1)
+
+        self.assertEqual(self.queue.status(job_id)["status"], "cancelled")
+
+    def test_failed_jobs_are_reported(self):
+        def fn(job):
+            raise RuntimeError("gpu on fire")
+
+        job_id = self.queue.submit("pharaohs", fn)
+        self.queue.get(job_id).wait(timeout=1)
+
+        status = self.queue.status(job_id)
+        self.assertEqual((status["status"], status["error"]), ("failed", "gpu on fire"))
+
+
+class TestRedisJobStore(unittest.TestCase):
+    def test_progress_and_dedup_are_shared_through_the_store(self):
+        store = RedisJobStore(client=FakeRedis())
+        release = threading.Event()
+        first = JobQueue(store=store, save_interval=0)
+        second = JobQueue(store=store, save_interval=0)
+        self.addCleanup(first.shutdown)
+        self.addCleanup(second.shutdown)
+
+        job_id = first.submit("pharaohs", lambda job: release.wait(1) and "story")
+
+        self.assertEqual(second.submit("pharaohs", lambda job: "other"), job_id)
+        release.set()
+        first.get(job_id).wait(timeout=1)
+        self.assertEqual(second.status(job_id)["result"], "story")
+        self.assertNotEqual(second.submit("pharaohs", lambda job: "again"), job_id)
+
+    def test_jobs_of_a_crashed_process_are_reported_as_lost(self):
+        redis = FakeRedis()
+        store = RedisJobStore(client=redis)
+        release = threading.Event()
+        first = JobQueue(store=store, save_interval=0)
+        second = JobQueue(store=store, save_interval=0)
+        self.addCleanup(first.shutdown)
+        self.addCleanup(second.shutdown)
+        self.addCleanup(release.set)
+
+        job_id = first.submit("pharaohs", lambda job: release.wait(1) and "story")
+        self.assertIn(second.status(job_id)["status"], ("queued", "running"))
+        # the claim expires once the owner stops refreshing it
+        redis.delete(f"{store.prefix}:key:pharaohs")
+
+        self.assertEqual(second.status(job_id)["status"], "failed")
+
+    def test_the_last_follower_cancels_a_job_of_another_process(self):
+        store = RedisJobStore(client=FakeRedis(), claim_ttl=0.15)
+        release = threading.Event()
+        first = JobQueue(store=store, save_interval=0)
+        second = JobQueue(store=store, save_interval=0)
+        self.addCleanup(first.shutdown)
+        self.addCleanup(second.shutdown)
+
+        def fn(job):
+            release.wait(timeout=1)
+            job.raise_if_cancelled()
+            return "story"
+
+        job_id = first.submit("pharaohs", fn)
+        self.assertEqual(second.submit("pharaohs", fn), job_id)
+
+        self.assertFalse(first.cancel(job_id))
+        self.assertTrue(second.cancel(job_id))
+        time.sleep(0.2)
+        release.set()
+        first.get(job_id).wait(timeout=1)
+
+        self.assertEqual(second.status(job_id)["status"], "cancelled")
+
+
+class TestStoryJob(unittest.TestCase):
+    def test_story_job_reports_progress(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.stream.return_value = iter(["Once upon ", "a time [a pyramid]."])
+        vision_model = MagicMock()
+        vision_model.generate_images.side_effect = lambda prompts: {
+            p: "aW1n" for p in prompts
+        }
+        queue = JobQueue()
+        self.addCleanup(queue.shutdown)
+        story = dict(
+            original_content="pharaohs",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+
+        job_id = queue.submit(
+            "pharaohs",
+            story_job(StoryTeller(llm=llm, visionModel=vision_model), **story),
+        )
+        html = queue.get(job_id).wait(timeout=1)
+
+        progress = queue.status(job_id)["progress"]
+        self.assertIn("<img src='data:image/jpeg;base64,aW1n'", html)
+        self.assertEqual(progress["text"], "Once upon a time [a pyramid].")
+        self.assertEqual((progress["images_done"], progress["images_total"]), (1, 1))
+        self.assertIn("total_seconds", progress["trace"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from app.services.llm import (
+    ClientPool,
+    NvidiaFoundationChatModel,
+    OllamaChatModel,
+    keep_alive_session,
+)
+
+
+class TestClientPool(unittest.TestCase):
+    def test_clients_are_reused_per_key(self):
+        pool = ClientPool(lambda key: object(), max_size=2)
+
+        with pool.acquire("llama3") as first:
+            pass
+        with pool.acquire("llama3") as second:
+            pass
+        with pool.acquire("phi3") as third:
+            pass
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+        self.assertEqual(pool.created, 2)
+
+    def test_concurrent_users_get_distinct_clients(self):
+        pool = ClientPool(lambda key: object(), max_size=2)
+
+        with pool.acquire("llama3") as first, pool.acquire("llama3") as second:
+            self.assertIsNot(first, second)
+
+    def test_acquire_blocks_when_pool_is_exhausted(self):
+        pool = ClientPool(lambda key: object(), max_size=1)
+        acquired = []
+
+        def use_client():
+            with pool.acquire("llama3") as client:
+                acquired.append(client)
+
+        with pool.acquire("llama3") as client:
+            worker = threading.Thread(target=use_client)
+            worker.start()
+            time.sleep(0.05)
+            self.assertEqual(acquired, [])
+        worker.join(timeout=1)
+
+        self.assertEqual(acquired, [client])
+        self.assertEqual(pool.created, 1)
+
+    def test_least_recently_used_keys_are_dropped(self):
+        pool = ClientPool(lambda key: object(), max_size=1, max_keys=1)
+
+        with pool.acquire("llama3"):
+            pass
+        with pool.acquire("phi3"):
+            pass
+        with pool.acquire("llama3"):
+            pass
+
+        self.assertEqual(pool.created, 3)
+
+
+class TestNvidiaFoundationChatModel(unittest.TestCase):
+    @patch("langchain_nvidia_ai_endpoints.ChatNVIDIA")
+    def test_invoke_reuses_clients_and_session(self, chat_nvidia):
+        chat_nvidia.return_value = MagicMock()
+        model = NvidiaFoundationChatModel(api_key="nvapi-test")
+
+        model.invoke(model_name="meta/llama3-70b-instruct", prompt="once")
+        model.invoke(model_name="meta/llama3-70b-instruct", prompt="upon")
+
+        chat_nvidia.assert_called_once_with(model="meta/llama3-70b-instruct")
+        client = chat_nvidia.return_value.client
+        self.assertIs(client.get_session_fn(), model._session)
+
+
+class TestOllamaChatModel(unittest.TestCase):
+    def test_available_models_are_read_from_the_tags_endpoint(self):
+        model = OllamaChatModel(base_url="http://ollama:11434/")
+        model._session = MagicMock()
+        model._session.get.return_value.json.return_value = {
+            "models": [{"name": "phi3:medium"}, {"name": "llama3:latest"}]
+        }
+
+        self.assertEqual(
+            model.get_available_models(),
+            [("1", "llama3:latest", ""), ("2", "phi3:medium", "")],
+        )
+        model._session.get.assert_called_once_with(
+            "http://ollama:11434/api/tags", timeout=5
+        )
+
+    def test_context_window_falls_back_to_the_model_family(self):
+        model = OllamaChatModel()
+
+        self.assertEqual(model.get_context_window("phi3:medium"), 4096)
+        self.assertEqual(model.get_context_window("llama3:latest"), 8192)
+        self.assertEqual(model.get_context_window("mistral:7b"), 4096)
+
+
+class TestKeepAliveSession(unittest.TestCase):
+    def test_requests_without_timeout_use_the_session_timeout(self):
+        # the server accepts the connection but never answers
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        self.addCleanup(server.close)
+        session = keep_alive_session(timeout=0.1)
+
+        start = time.perf_counter()
+        with self.assertRaises(requests.Timeout):
+            session.get(f"http://127.0.0.1:{server.getsockname()[1]}/")
+
+        self.assertLess(time.perf_counter() - start, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+from app.services.metrics import MetricsRegistry, StoryTrace, start_metrics_server
+
+
+class TestStoryTrace(unittest.TestCase):
+    @patch("app.services.metrics.count_tokens", side_effect=lambda t, e: len(t.split()))
+    def test_trace_records_stages_tokens_and_images(self, _):
+        trace = StoryTrace("llama3")
+
+        with trace.stage("llm"):
+            time.sleep(0.01)
+        with trace.stage("llm"):
+            time.sleep(0.01)
+        trace.count_tokens("prompt", "tell me a story")
+        trace.count_tokens("completion", "once upon a time")
+        trace.count_images(requested=2, generated=1)
+
+        result = trace.to_dict()
+        self.assertGreaterEqual(result["stages"]["llm"], 0.02)
+        self.assertEqual(result["tokens"], {"prompt": 4, "completion": 4})
+        self.assertEqual(
+            result["images"], {"requested": 2, "generated": 1, "failed": 1}
+        )
+
+    @patch("app.services.metrics.count_tokens", return_value=None)
+    def test_tokens_are_skipped_without_encoding(self, _):
+        trace = StoryTrace("llama3")
+
+        trace.count_tokens("prompt", "tell me a story")
+
+        self.assertEqual(trace.tokens, {})
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_render_prometheus_text(self):
+        registry = MetricsRegistry()
+        trace = StoryTrace("meta/llama3")
+        trace.stages["llm"] = 1.5
+        trace.tokens["completion"] = 42
+        trace.count_images(requested=2, generated=2)
+        trace.total_seconds = 2.0
+
+        registry.record(trace)
+        registry.observe("stage_seconds", 0.5, stage="llm")
+
+        output = registry.render()
+        self.assertIn("# TYPE learntales_stories_total counter", output)
+        self.assertIn('learntales_stories_total{model="meta/llama3"} 1', output)
+        self.assertIn(
+            'learntales_tokens_total{kind="completion",model="meta/llama3"} 42',
+            output,
+        )
+        self.assertIn('learntales_images_total{status="generated"} 2', output)
+        self.assertIn('learntales_stage_seconds_sum{stage="llm"} 2.0', output)
+        self.assertIn('learntales_stage_seconds_count{stage="llm"} 2', output)
+
+    def test_time_to_first_token_is_not_a_stage(self):
+        registry = MetricsRegistry()
+        trace = StoryTrace("llama3")
+        trace.stages["llm"] = 1.5
+        trace.time_to_first_token = 0.25
+
+        registry.record(trace)
+
+        output = registry.render()
+        self.assertIn(
+            'learntales_time_to_first_token_seconds_sum{model="llama3"} 0.25', output
+        )
+        self.assertNotIn('stage="time_to_first_token"', output)
+
+    def test_metrics_server_serves_the_registry(self):
+        registry = MetricsRegistry()
+        registry.inc("stories_total", model="llama3")
+        server = start_metrics_server(0, host="127.0.0.1", registry=registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}"
+
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            self.assertEqual(response.read().decode(), registry.render())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+
+    def test_label_values_are_escaped(self):
+        registry = MetricsRegistry()
+
+        registry.inc("stories_total", model='say "hi"')
+
+        self.assertIn('model="say \\"hi\\""', registry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
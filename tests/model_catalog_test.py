@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from app.services.model_catalog import ModelCatalog
+
+models = [("1", "llama3:latest", "")]
+
+
+def make_llm(name="Ollama", api_key=None):
+    llm = MagicMock()
+    llm.name = (name,)
+    llm.api_key = api_key
+    llm.get_available_models.return_value = models
+    return llm
+
+
+class TestModelCatalog(unittest.TestCase):
+    def test_models_are_loaded_once_within_the_ttl(self):
+        catalog = ModelCatalog(ttl=60)
+        llm = make_llm()
+
+        self.assertEqual(catalog.get(llm), models)
+        self.assertEqual(catalog.get(llm), models)
+
+        llm.get_available_models.assert_called_once()
+
+    def test_catalogs_are_kept_per_provider_and_api_key(self):
+        catalog = ModelCatalog(ttl=60)
+        ollama, nvidia = make_llm(), make_llm("Nvidia Foundation", "nvapi-1")
+        nvidia.get_available_models.return_value = [("2", "google/gemma-7b", "")]
+
+        self.assertEqual(catalog.get(ollama), models)
+        self.assertEqual(catalog.get(nvidia), [("2", "google/gemma-7b", "")])
+        catalog.get(make_llm("Nvidia Foundation", "nvapi-2"))
+
+        self.assertEqual(nvidia.get_available_models.call_count, 1)
+
+    def test_stale_models_are_served_while_refreshing(self):
+        catalog = ModelCatalog(ttl=0)
+        llm = make_llm()
+        catalog.get(llm)
+        refreshing, release = threading.Event(), threading.Event()
+
+        def slow_refresh():
+            refreshing.set()
+            release.wait(timeout=1)
+            return [("1", "phi3:medium", "")]
+
+        llm.get_available_models.side_effect = slow_refresh
+
+        self.assertEqual(catalog.get(llm), models)
+        self.assertTrue(refreshing.wait(timeout=1))
+        self.assertEqual(catalog.get(llm), models)
+        release.set()
+        for _ in range(100):
+            if catalog.get(llm) != models:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(catalog.get(llm), [("1", "phi3:medium", "")])
+
+    def test_stale_models_are_kept_when_the_refresh_fails(self):
+        catalog = ModelCatalog(ttl=60)
+        llm = make_llm()
+        catalog.get(llm)
+        llm.get_available_models.side_effect = ConnectionError("offline")
+
+        self.assertIsNone(catalog.refresh(llm))
+        self.assertEqual(catalog.get(llm), models)
+
+    def test_failed_loads_are_retried_after_the_retry_interval(self):
+        catalog = ModelCatalog(ttl=60, retry_interval=60)
+        llm = make_llm()
+        llm.get_available_models.side_effect = ConnectionError("offline")
+
+        self.assertEqual(catalog.get(llm), [])
+        self.assertEqual(catalog.get(llm), [])
+        llm.get_available_models.assert_called_once()
+
+        catalog.retry_interval = 0
+        catalog.invalidate(llm)
+        llm.get_available_models.side_effect = None
+        self.assertEqual(catalog.get(llm), models)
+
+
+if __name__ == "__main__":
+    unittest.main()
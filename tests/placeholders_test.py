@@ -0,0 +1,109 @@
+import unittest
+
+from app.services.placeholders import (
+    PlaceholderParser,
+    Token,
+    normalize_prompt,
+    select_prompts,
+    tokenize,
+)
+
+
+def feed_all(chunks: list[str]) -> list[Token]:
+    parser = PlaceholderParser()
+    tokens = []
+    for chunk in chunks:
+        tokens.extend(parser.feed(chunk))
+    return tokens + parser.close()
+
+
+class TestTokenize(unittest.TestCase):
+    def test_text_and_placeholders_are_split_in_one_pass(self):
+        self.assertEqual(
+            list(tokenize("Once [a cat] met [a dog].")),
+            [
+                Token("Once "),
+                Token("[a cat]", "a cat"),
+                Token(" met "),
+                Token("[a dog]", "a dog"),
+                Token("."),
+            ],
+        )
+
+    def test_empty_nested_and_unbalanced_brackets(self):
+        self.assertEqual(list(tokenize("[]")), [Token("[]")])
+        self.assertEqual(
+            list(tokenize("[a [b] c]")),
+            [Token("[a "), Token("[b]", "b"), Token(" c]")],
+        )
+        self.assertEqual(list(tokenize("a] [b")), [Token("a] [b")])
+        self.assertEqual(list(tokenize("[a\nb]")), [Token("[a\nb]")])
+
+    def test_prompts_are_normalized(self):
+        self.assertEqual(normalize_prompt("A Cat, on the mat!"), "cat mat")
+        self.assertEqual(normalize_prompt("the mat with a cat"), "mat cat")
+        self.assertNotEqual(
+            normalize_prompt("a dog chasing a cat"),
+            normalize_prompt("a cat chasing a dog"),
+        )
+        self.assertNotEqual(normalize_prompt("a cat"), normalize_prompt("a dog"))
+
+    def test_prompts_are_selected_up_to_a_limit(self):
+        self.assertEqual(
+            select_prompts(["a cat", "a dog", "The cat!", "a pyramid"], 2),
+            {"a cat": "a cat", "a dog": "a dog", "The cat!": "a cat"},
+        )
+        self.assertEqual(len(select_prompts(["a", "b", "c"])), 3)
+
+
+class TestPlaceholderParser(unittest.TestCase):
+    def test_placeholders_across_chunk_boundaries(self):
+        tokens = feed_all(
+            ["Once upon ", "a time [a py", "ramid] stood ", "[]", " [a cat]."]
+        )
+
+        self.assertEqual(
+            [t.placeholder for t in tokens if t.placeholder is not None],
+            ["a pyramid", "a cat"],
+        )
+        self.assertEqual(
+            "".join(t.text for t in tokens),
+            "Once upon a time [a pyramid] stood [] [a cat].",
+        )
+
+    def test_placeholders_are_emitted_as_soon_as_they_are_closed(self):
+        parser = PlaceholderParser()
+
+        self.assertEqual(parser.feed("Once [a"), [Token("Once ")])
+        self.assertEqual(
+            parser.feed(" cat] met"), [Token("[a cat]", "a cat"), Token(" met")]
+        )
+
+    def test_any_chunking_gives_the_same_tokens(self):
+        content = "Once [a cat] met [a [big] dog] and [unclosed\n[a bird]] end [open"
+        expected = feed_all([content])
+
+        for size in range(1, 12):
+            chunks = [content[i : i + size] for i in range(0, len(content), size)]
+            tokens = feed_all(chunks)
+            self.assertEqual(
+                [t.placeholder for t in tokens if t.placeholder is not None],
+                ["a cat", "big", "a bird"],
+            )
+            self.assertEqual("".join(t.text for t in tokens), content)
+            self.assertEqual(
+                [t for t in tokens if t.placeholder is not None],
+                [t for t in expected if t.placeholder is not None],
+            )
+
+    def test_long_open_brackets_are_not_held_back(self):
+        parser = PlaceholderParser(max_length=5)
+
+        self.assertEqual(
+            parser.feed("[this is no placeholder"), [Token("[this is no placeholder")]
+        )
+        self.assertEqual(parser.close(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
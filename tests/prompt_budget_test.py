@@ -0,0 +1,146 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import tiktoken
+
+from app.services import prompt_budget
+from app.services.prompt_budget import (
+    PromptBudget,
+    count_tokens,
+    read_paragraphs,
+    split_tokens,
+)
+from app.services.storyteller import StoryTeller
+
+# one token per byte, so the tests do not need to download an encoding
+byte_encoding = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+@patch.object(prompt_budget, "get_encoding", lambda name: byte_encoding)
+class TestPromptBudget(unittest.TestCase):
+    def test_tokens_are_counted_with_the_cached_encoder(self):
+        self.assertEqual(count_tokens("pharaoh"), 7)
+
+    def test_content_is_truncated_to_the_available_tokens(self):
+        budget = PromptBudget("llama3", context_window=30, completion_tokens=10)
+
+        self.assertEqual(budget.available("template"), 12)
+        self.assertTrue(budget.fits("template", "pharaohs"))
+        self.assertFalse(budget.fits("template", "pharaohs ruled egypt"))
+        self.assertEqual(
+            budget.truncate("template", "pharaohs ruled egypt"), "pharaohs rul"
+        )
+
+    def test_chunks_respect_the_token_limit_and_overlap(self):
+        paragraphs = ["one two three", "four five", "six seven eight nine"]
+
+        chunks = list(split_tokens(paragraphs, chunk_tokens=15, chunk_overlap=0))
+        self.assertEqual(
+            chunks, ["one two three", "four five\n\nsix", "seven eight", "nine"]
+        )
+
+        chunks = list(
+            split_tokens(["aaaa bbbb cccc dddd"], chunk_tokens=10, chunk_overlap=5)
+        )
+        self.assertEqual(chunks, ["aaaa bbbb", "bbbb cccc", "cccc dddd"])
+
+    def test_words_longer_than_a_chunk_are_sliced(self):
+        chunks = list(split_tokens(["abcdefghij"], chunk_tokens=4))
+
+        self.assertEqual(chunks, ["abcd", "efgh", "ij"])
+
+    def test_paragraphs_are_read_across_blocks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "lesson.txt"
+            path.write_text("first paragraph\n\nsecond\nline\n\n\n\nthird")
+
+            paragraphs = list(read_paragraphs(str(path), block_size=4))
+
+        self.assertEqual(paragraphs, ["first paragraph", "second\nline", "third"])
+
+    def test_text_without_blank_lines_is_read_in_bounded_pieces(self):
+        text = "\n".join(" ".join(["word"] * 20) for _ in range(50))
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "lesson.txt"
+            path.write_text(text)
+
+            paragraphs = list(read_paragraphs(str(path), block_size=64))
+
+        self.assertGreater(len(paragraphs), 1)
+        self.assertTrue(all(len(p) <= 4 * 64 + 64 for p in paragraphs))
+        self.assertEqual("".join(paragraphs), text)
+
+    def test_plain_text_files_are_chunked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "lesson.txt"
+            path.write_text("pharaohs ruled egypt\n\nthe nile flooded every year")
+
+            chunks = StoryTeller.get_content_from_plain_text_file(
+                str(path), chunk_size=30
+            )
+
+        self.assertEqual(
+            chunks, ["pharaohs ruled egypt", "the nile flooded every year"]
+        )
+
+
+class TestGetEncoding(unittest.TestCase):
+    def test_failed_loads_are_not_cached(self):
+        prompt_budget._load_encoding.cache_clear()
+        self.addCleanup(prompt_budget._load_encoding.cache_clear)
+        self.addCleanup(prompt_budget._failed_encodings.clear)
+        with patch.object(
+            tiktoken, "get_encoding", side_effect=[ConnectionError(), byte_encoding]
+        ) as get_encoding:
+            self.assertIsNone(prompt_budget.get_encoding("bytes"))
+            # the failure is remembered for a while, not for the whole process
+            self.assertIsNone(prompt_budget.get_encoding("bytes"))
+            with patch.object(prompt_budget, "ENCODING_RETRY_SECONDS", 0):
+                self.assertIs(prompt_budget.get_encoding("bytes"), byte_encoding)
+            self.assertIs(prompt_budget.get_encoding("bytes"), byte_encoding)
+
+        self.assertEqual(get_encoding.call_count, 2)
+
+
+@patch.object(prompt_budget, "get_encoding", lambda name: byte_encoding)
+class TestFitToContext(unittest.TestCase):
+    def setUp(self):
+        self.llm = MagicMock()
+        self.llm.invoke.return_value = MagicMock(content="short summary")
+        self.storyteller = StoryTeller(llm=self.llm, visionModel=MagicMock())
+
+    def test_content_within_the_context_is_kept(self):
+        self.llm.get_context_window.return_value = 2000
+
+        self.assertEqual(
+            self.storyteller.fit_to_context("pharaohs", "llama3", template="tell"),
+            "pharaohs",
+        )
+        self.llm.invoke.assert_not_called()
+
+    def test_long_content_is_condensed(self):
+        self.llm.get_context_window.return_value = 1600
+
+        content = self.storyteller.fit_to_context("pharaohs " * 500, "llama3", "tell")
+
+        # the single paragraph is split into chunks whose summaries already fit
+        self.assertEqual(content.split("\n\n"), ["short summary"] * 5)
+
+    def test_content_is_truncated_when_condensing_is_not_enough(self):
+        self.llm.get_context_window.return_value = 1510
+        self.llm.invoke.return_value = MagicMock(content="a long summary")
+
+        content = self.storyteller.fit_to_context("pharaohs " * 500, "llama3", "tell")
+
+        self.assertEqual(content, "a long")
+
+
+if __name__ == "__main__":
+    unittest.main()
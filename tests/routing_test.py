@@ -0,0 +1,180 @@
+import random
+import time
+import unittest
+from typing import Iterator
+
+from langchain_core.messages import BaseMessage
+
+from app.services.llm import BaseChatModel
+from app.services.routing import BackendHealth, Route, RoutingChatModel
+
+
+class StubChatModel(BaseChatModel):
+    def __init__(self, name: str, latency: float = 0.0, fail: bool = False):
+        super().__init__(name)
+        self.latency = latency
+        self.fail = fail
+        self.calls = []
+
+    def invoke(self, model_name: str, prompt: str, labels: dict = None) -> BaseMessage:
+        self.calls.append(model_name)
+        time.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError(f"{self.name[0]} is down")
+        return BaseMessage(content=f"{self.name[0]}: {prompt}", type="str")
+
+    def stream(
+        self, model_name: str, prompt: str, labels: dict = None
+    ) -> Iterator[str]:
+        self.calls.append(model_name)
+        time.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError(f"{self.name[0]} is down")
+        yield f"{self.name[0]}: "
+        yield prompt
+
+
+class TestBackendHealth(unittest.TestCase):
+    def test_breaker_opens_and_lets_a_single_trial_through(self):
+        health = BackendHealth(failure_threshold=2, reset_timeout=0.05)
+
+        health.record_failure()
+        self.assertEqual(health.state, "closed")
+        health.record_failure()
+        self.assertEqual(health.state, "open")
+        self.assertFalse(health.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(health.allow())
+        self.assertFalse(health.allow())
+        health.record_success(0.1)
+        self.assertEqual(health.state, "closed")
+
+    def test_latency_and_error_rate_are_averaged(self):
+        health = BackendHealth(alpha=0.5)
+
+        health.record_success(1.0)
+        health.record_success(3.0)
+        health.record_failure()
+
+        self.assertEqual(health.latency, 2.0)
+        self.assertEqual(health.error_rate, 0.5)
+
+
+class TestRoutingChatModel(unittest.TestCase):
+    def test_failed_backends_fall_over_to_the_next(self):
+        nvidia = StubChatModel("nvidia", fail=True)
+        ollama = StubChatModel("ollama")
+        llm = RoutingChatModel(
+            [
+                Route(nvidia, weight=1000),
+                Route(ollama, model_names={"llama3": "llama3:latest"}),
+            ],
+            rng=random.Random(1),
+        )
+
+        self.assertEqual(llm.invoke("llama3", "once").content, "ollama: once")
+        self.assertEqual((nvidia.calls, ollama.calls), (["llama3"], ["llama3:latest"]))
+        self.assertGreater(llm.routes[0].health.error_rate, 0)
+        self.assertTrue(llm.fell_back())
+
+        nvidia.fail = False
+        llm.routes[0].health = BackendHealth()
+        llm.invoke("llama3", "once")
+        self.assertFalse(llm.fell_back())
+
+    def test_open_breakers_are_skipped(self):
+        nvidia = StubChatModel("nvidia", fail=True)
+        ollama = StubChatModel("ollama")
+        llm = RoutingChatModel(
+            [
+                Route(nvidia, weight=1000, health=BackendHealth(failure_threshold=1)),
+                Route(ollama),
+            ],
+            rng=random.Random(1),
+        )
+
+        for _ in range(5):
+            llm.invoke("llama3", "once")
+
+        self.assertEqual(len(nvidia.calls), 1)
+        self.assertEqual(llm.health()["nvidia"]["state"], "open")
+
+    def test_requests_are_balanced_by_weight(self):
+        nvidia, ollama = StubChatModel("nvidia"), StubChatModel("ollama")
+        llm = RoutingChatModel(
+            [Route(nvidia, weight=3), Route(ollama, weight=1)], rng=random.Random(7)
+        )
+        for route in llm.routes:
+            route.health.record_success(0.1)
+
+        for _ in range(400):
+            llm.invoke("llama3", "once")
+
+        self.assertAlmostEqual(len(nvidia.calls) / 400, 0.75, delta=0.1)
+
+    def test_slow_backends_are_hedged(self):
+        slow, fast = StubChatModel("slow", latency=0.5), StubChatModel("fast")
+        llm = RoutingChatModel(
+            [Route(slow, weight=1000), Route(fast)],
+            hedge=True,
+            hedge_delay=0.05,
+            rng=random.Random(1),
+        )
+
+        start = time.perf_counter()
+        result = llm.invoke("llama3", "once")
+
+        self.assertEqual(result.content, "fast: once")
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(len(slow.calls), 1)
+
+    def test_stream_falls_over_before_the_first_chunk(self):
+        llm = RoutingChatModel(
+            [
+                Route(StubChatModel("nvidia", fail=True), weight=1000),
+                Route(StubChatModel("ollama")),
+            ],
+            rng=random.Random(1),
+        )
+
+        self.assertEqual("".join(llm.stream("llama3", "once")), "ollama: once")
+        self.assertTrue(llm.fell_back())
+
+    def test_hedged_stream_uses_the_first_backend_with_output(self):
+        llm = RoutingChatModel(
+            [
+                Route(StubChatModel("slow", latency=0.5), weight=1000),
+                Route(StubChatModel("fast")),
+            ],
+            hedge=True,
+            hedge_delay=0.05,
+            rng=random.Random(1),
+        )
+
+        self.assertEqual("".join(llm.stream("llama3", "once")), "fast: once")
+
+    def test_backends_without_weight_are_only_fallbacks(self):
+        nvidia = StubChatModel("nvidia")
+        ollama = StubChatModel("ollama")
+        llm = RoutingChatModel([Route(nvidia), Route(ollama, weight=0)])
+
+        for _ in range(20):
+            llm.invoke("llama3", "once")
+        self.assertEqual((len(nvidia.calls), ollama.calls), (20, []))
+
+        nvidia.fail = True
+        llm.routes[0].health.opened_at = time.monotonic()
+        self.assertEqual(llm.invoke("llama3", "once").content, "ollama: once")
+
+    def test_no_available_backend_raises(self):
+        health = BackendHealth(failure_threshold=1)
+        health.record_failure()
+        llm = RoutingChatModel([Route(StubChatModel("nvidia"), health=health)])
+
+        with self.assertRaises(RuntimeError):
+            llm.invoke("llama3", "once")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,10 @@
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import MagicMock
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+from app.services.cache import Cache
 from app.services.storyteller import StoryTeller
 
 
@@ -8,7 +13,28 @@ class TestStoryTeller(unittest.TestCase):
         self.storyteller = StoryTeller(llm=MagicMock(), visionModel=MagicMock())
 
     def test_generate_images_from_prompt(self):
-        self.fail()
+        self.storyteller.visionModel.generate_images.return_value = {
+            "a cat": "Y2F0",
+            "a big dog": "ZG9n",
+        }
+
+        with tempfile.TemporaryDirectory() as output_folder:
+            result = self.storyteller.generate_images_from_prompt(
+                ["a cat", "a big dog"], output_folder_path=output_folder, fake=False
+            )
+
+            self.assertEqual(result, {"a cat": "Y2F0", "a big dog": "ZG9n"})
+            self.assertEqual(
+                (Path(output_folder) / "a_big_dog.jpg").read_bytes(), b"dog"
+            )
+        self.storyteller.visionModel.generate_images.assert_called_once_with(
+            ["a cat", "a big dog"]
+        )
+
+        fake_images = self.storyteller.generate_images_from_prompt(
+            ["a cat"], output_folder_path=None, fake=True
+        )
+        self.assertEqual(list(fake_images), ["a cat"])
 
     def test_visualize(self):
         expected_output = ["placeholder1", "placeholder2"]
@@ -32,6 +58,389 @@ class TestStoryTeller(unittest.TestCase):
         result = self.storyteller.extract_placeholders_from_text(content=test_content)
         self.assertEqual(result, expected_output)
 
+        expected_output = ["inner", "placeholder2"]
+        test_content = "[outer [inner] text] [unclosed [placeholder2]"
+        result = self.storyteller.extract_placeholders_from_text(content=test_content)
+        self.assertEqual(result, expected_output)
+
+    def test_transform_text_to_html_replaces_placeholders(self):
+        html = self.storyteller.transform_text_to_html(
+            "[a cat] and [a cat] but [no image] and []",
+            {"a cat": "Y2F0"},
+            model_name="llama3",
+        )
+
+        image = (
+            "<img src='data:image/jpeg;base64,Y2F0' alt='a cat' "
+            "style='float: left; margin: 10px; width: 150px' />"
+        )
+        self.assertEqual(html, f"<p>{image} and {image} but [no image] and []</p>")
+
+    def test_transform_text_to_html_sanitizes_markdown(self):
+        html = self.storyteller.transform_text_to_html(
+            "Once **upon** a time [a cat]\n\n<script>alert(1)</script>",
+            {"a cat": "Y2F0"},
+            model_name="llama3",
+        )
+
+        self.assertTrue(html.startswith("<p>Once <strong>upon</strong> a time <img"))
+        self.assertNotIn("script", html)
+        self.storyteller.llm.invoke.assert_not_called()
+
+    def test_transform_text_to_html_with_llm_only_sends_image_markers(self):
+        self.storyteller.llm.invoke.return_value = MagicMock(
+            content="<div><p>Once @@image-0@@ sat.</p><script></script>"
+        )
+
+        html = self.storyteller.transform_text_to_html(
+            "Once [a cat] sat.", {"a cat": "Y2F0" * 1000}, "llama3", with_llm=True
+        )
+
+        prompt = self.storyteller.llm.invoke.call_args.kwargs["prompt"]
+        self.assertIn("Once @@image-0@@ sat.", prompt)
+        self.assertNotIn("Y2F0", prompt)
+        self.assertTrue(
+            html.startswith("<p>Once <img src='data:image/jpeg;base64,Y2F0")
+        )
+        self.assertTrue(html.endswith(" sat.</p>"))
+
+    def test_transform_text_to_html_falls_back_when_the_llm_drops_images(self):
+        self.storyteller.llm.invoke.return_value = MagicMock(content="<p>Once sat.</p>")
+
+        html = self.storyteller.transform_text_to_html(
+            "Once [a cat] sat.", {"a cat": "Y2F0"}, "llama3", with_llm=True
+        )
+
+        self.assertIn("<img src='data:image/jpeg;base64,Y2F0'", html)
+
+    def test_tell_stream(self):
+        chunks = ["Once upon ", "a time [a py", "ramid] stood ", "[]", " [a cat]."]
+        pyramid_started = threading.Event()
+
+        def stream(model_name, prompt, labels=None):
+            for chunk in chunks:
+                if chunk == chunks[-1]:
+                    # the first image is drawn while the text is still streaming
+                    self.assertTrue(pyramid_started.wait(timeout=1))
+                yield chunk
+
+        def generate_images(prompts):
+            if prompts == ["a pyramid"]:
+                pyramid_started.set()
+            return {p: p.upper() for p in prompts}
+
+        vision_model = MagicMock()
+        vision_model.generate_images.side_effect = generate_images
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.stream.side_effect = stream
+        storyteller = StoryTeller(llm=llm, visionModel=vision_model)
+
+        stream = storyteller.tell_stream(
+            original_content="pyramids",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+        received = []
+        with self.assertRaises(StopIteration) as stop:
+            while True:
+                received.append(next(stream))
+
+        self.assertEqual(received, chunks)
+        self.assertEqual(vision_model.generate_images.call_count, 2)
+        self.assertIn("base64,A PYRAMID", stop.exception.value)
+        self.assertIn("base64,A CAT", stop.exception.value)
+        self.assertIn("[]", stop.exception.value)
+
+    def test_tell_stream_times_only_the_model(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.stream.return_value = iter(["Once ", "upon ", "a time."])
+        storyteller = StoryTeller(llm=llm, visionModel=MagicMock())
+
+        for _ in storyteller.tell_stream(
+            original_content="cats",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        ):
+            time.sleep(0.05)
+
+        trace = storyteller.last_trace
+        self.assertLess(trace.stages["llm"], 0.05)
+        self.assertNotIn("time_to_first_token", trace.stages)
+        self.assertLess(trace.time_to_first_token, 0.05)
+
+    def test_tell_stream_limits_and_shares_images(self):
+        vision_model = MagicMock()
+        vision_model.generate_images.side_effect = lambda prompts: {
+            p: p.upper() for p in prompts
+        }
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.stream.return_value = iter(
+            ["[a cat] met [The cat]", " and [a dog] near [a pyramid]."]
+        )
+        storyteller = StoryTeller(llm=llm, visionModel=vision_model, max_images=2)
+
+        stream = storyteller.tell_stream(
+            original_content="pyramids",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+        with self.assertRaises(StopIteration) as stop:
+            while True:
+                next(stream)
+
+        self.assertEqual(vision_model.generate_images.call_count, 2)
+        self.assertEqual(stop.exception.value.count("base64,A CAT"), 2)
+        self.assertIn("base64,A DOG", stop.exception.value)
+        self.assertIn("[a pyramid]", stop.exception.value)
+
+    def test_tell_limits_images_per_story(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.invoke.return_value = MagicMock(
+            content="[a cat], [a dog], [the cat] and [a pyramid]."
+        )
+        vision_model = MagicMock()
+        vision_model.generate_images.side_effect = lambda prompts: {
+            p: p.upper() for p in prompts
+        }
+        storyteller = StoryTeller(llm=llm, visionModel=vision_model, max_images=2)
+
+        html = storyteller.tell(
+            original_content="pyramids",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+
+        vision_model.generate_images.assert_called_once_with(["a cat", "a dog"])
+        self.assertEqual(html.count("base64,A CAT"), 2)
+        self.assertEqual(storyteller.last_trace.images["requested"], 2)
+
+    def test_tell_uses_story_cache(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.fell_back.return_value = False
+        llm.invoke.return_value = MagicMock(content="A story about [a pyramid].")
+        vision_model = MagicMock()
+        vision_model.generate_images.return_value = {}
+        storyteller = StoryTeller(
+            llm=llm, visionModel=vision_model, cache=Cache(path=":memory:")
+        )
+        arguments = dict(
+            original_content="pyramids",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+
+        first = storyteller.tell(**arguments)
+        second = storyteller.tell(**arguments)
+        storyteller.tell(**{**arguments, "language": "german"})
+
+        self.assertEqual(first, second)
+        self.assertEqual(llm.invoke.call_count, 2)
+        self.assertEqual(storyteller.cache.stats()["story"]["hits"], 1)
+        self.assertEqual(storyteller.cache.stats()["story"]["misses"], 2)
+
+    def test_tell_does_not_cache_stories_of_a_fallback(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.fell_back.return_value = True
+        llm.invoke.return_value = MagicMock(content="Once upon a time.")
+        storyteller = StoryTeller(
+            llm=llm, visionModel=MagicMock(), cache=Cache(":memory:")
+        )
+        story = dict(
+            original_content="cats",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+
+        storyteller.tell(**story)
+        storyteller.tell(**story)
+
+        self.assertEqual(llm.invoke.call_count, 2)
+
+    def test_transform_text_to_html_references_stored_images(self):
+        self.storyteller.image_store = MagicMock()
+        self.storyteller.image_store.put.return_value = "abc"
+        self.storyteller.image_store.url.return_value = "app/static/images/abc.jpg"
+
+        result = self.storyteller.transform_text_to_html(
+            "Once [a cat] sat.", {"a cat": "Y2F0"}, model_name="llama3"
+        )
+
+        self.assertEqual(
+            result,
+            "<p>Once <img src='app/static/images/abc.jpg' alt='a cat' "
+            "style='float: left; margin: 10px; width: 150px' /> sat.</p>",
+        )
+        self.storyteller.image_store.put.assert_called_once_with("Y2F0")
+
+    def test_fit_to_context_only_condenses_what_does_not_fit(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        condenser = MagicMock()
+        condenser.condense_text.return_value = "short"
+        storyteller = StoryTeller(llm=llm, visionModel=MagicMock(), condenser=condenser)
+
+        content = storyteller.fit_to_context("cats", "llama3", template="Tell: ")
+        self.assertEqual(content, "cats")
+        condenser.condense_text.assert_not_called()
+
+        content = storyteller.fit_to_context("cats " * 20000, "llama3", "Tell: ")
+        self.assertEqual(content, "short")
+        _, kwargs = condenser.condense_text.call_args
+        self.assertLess(kwargs["max_tokens"], 8192)
+
+    def test_fit_to_context_truncates_when_condensing_is_off(self):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        condenser = MagicMock()
+        storyteller = StoryTeller(
+            llm=llm, visionModel=MagicMock(), condenser=condenser, condense=False
+        )
+
+        content = storyteller.fit_to_context("cats " * 20000, "llama3", "Tell: ")
+
+        condenser.condense_text.assert_not_called()
+        llm.invoke.assert_not_called()
+        self.assertTrue(("cats " * 20000).startswith(content))
+        self.assertLess(len(content), len("cats " * 20000))
+
+    @patch("app.services.metrics.count_tokens", return_value=10)
+    def test_tell_records_trace(self, _):
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.invoke.return_value = MagicMock(content="Once [a cat] and [a dog].")
+        vision_model = MagicMock()
+        vision_model.generate_images.return_value = {"a cat": "Y2F0"}
+        storyteller = StoryTeller(llm=llm, visionModel=vision_model)
+
+        storyteller.tell(
+            original_content="cats",
+            model_name="llama3",
+            audience="children",
+            from_year=5,
+            to_year=7,
+            language="english",
+        )
+
+        trace = storyteller.last_trace.to_dict()
+        self.assertEqual(
+            set(trace["stages"]),
+            {
+                "condense",
+                "llm",
+                "extract_placeholders",
+                "generate_images",
+                "transform_html",
+            },
+        )
+        self.assertEqual(trace["tokens"], {"prompt": 10, "completion": 10})
+        self.assertEqual(trace["images"], {"requested": 2, "generated": 1, "failed": 1})
+
+    def test_tell_variants_shares_images_across_variants(self):
+        stories = {
+            "english": "Once [a cat.] met [The Cat] and [a dog].",
+            "german": "Es war einmal [A cat] und [a pyramid].",
+        }
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.fell_back.return_value = False
+        llm.invoke.side_effect = lambda model_name, prompt: MagicMock(
+            content=stories["german" if "only in german" in prompt else "english"]
+        )
+        vision_model = MagicMock()
+        vision_model.generate_images.side_effect = lambda prompts: {
+            p: p.upper() for p in prompts
+        }
+        storyteller = StoryTeller(
+            llm=llm, visionModel=vision_model, cache=Cache(":memory:")
+        )
+        variants = [("english", 5, 7), ("english", 8, 10), ("german", 5, 7)]
+
+        result = storyteller.tell_variants(
+            original_content="pharaohs",
+            model_name="llama3",
+            audience="children",
+            variants=variants + [("german", 5, 7)],
+        )
+
+        self.assertEqual(list(result), variants)
+        self.assertEqual(llm.invoke.call_count, 3)
+        vision_model.generate_images.assert_called_once_with(
+            ["a cat.", "a dog", "a pyramid"]
+        )
+        self.assertEqual(result[("german", 5, 7)].count("base64,A CAT."), 1)
+        self.assertEqual(result[("english", 8, 10)].count("base64,A CAT."), 2)
+        self.assertEqual(storyteller.last_trace.images["requested"], 3)
+
+        storyteller.tell_variants(
+            original_content="pharaohs",
+            model_name="llama3",
+            audience="children",
+            variants=variants,
+        )
+        self.assertEqual(llm.invoke.call_count, 3)
+
+    def test_tell_variants_keeps_the_variants_that_succeeded(self):
+        def invoke(model_name, prompt):
+            if "only in german" in prompt:
+                raise ConnectionError("unavailable")
+            return MagicMock(content="Once [a cat].")
+
+        llm = MagicMock()
+        llm.get_context_window.return_value = 8192
+        llm.fell_back.return_value = False
+        llm.invoke.side_effect = invoke
+        vision_model = MagicMock()
+        vision_model.generate_images.side_effect = lambda prompts: {
+            p: p.upper() for p in prompts
+        }
+        storyteller = StoryTeller(
+            llm=llm, visionModel=vision_model, cache=Cache(":memory:")
+        )
+        variants = [("english", 5, 7), ("german", 5, 7)]
+
+        result = storyteller.tell_variants(
+            original_content="cats",
+            model_name="llama3",
+            audience="children",
+            variants=variants,
+        )
+
+        self.assertIn("base64,A CAT", result[("english", 5, 7)])
+        self.assertIsInstance(result[("german", 5, 7)], ConnectionError)
+
+        llm.invoke.side_effect = lambda model_name, prompt: MagicMock(content="Es war")
+        storyteller.tell_variants(
+            original_content="cats",
+            model_name="llama3",
+            audience="children",
+            variants=variants,
+        )
+        self.assertEqual(llm.invoke.call_count, 3)
+
 
 if __name__ == "__main__":
     unittest.main()
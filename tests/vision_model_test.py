@@ -0,0 +1,107 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.services.cache import Cache
+from app.services.vision_model import NvidiaFoundationVisionModel
+
+
+class SlowGenerator:
+    def __init__(self, latency: float, failing: set[str] = None, flaky: int = 0):
+        self.latency = latency
+        self.failing = failing or set()
+        self.flaky = flaky
+        self.calls = 0
+
+    def invoke(self, prompt: str):
+        self.calls += 1
+        time.sleep(self.latency)
+        if prompt in self.failing:
+            raise ValueError(f"cannot draw {prompt}")
+        if self.flaky > 0:
+            self.flaky -= 1
+            raise ConnectionError("temporarily unavailable")
+        return MagicMock(response_metadata={"artifacts": [{"base64": prompt[::-1]}]})
+
+
+class TestNvidiaFoundationVisionModel(unittest.TestCase):
+    def build_model(self, generator: SlowGenerator, **kwargs):
+        model = NvidiaFoundationVisionModel(api_key="", **kwargs)
+        patcher = patch.object(model, "_build_image_gen", return_value=generator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return model
+
+    def test_generate_images_runs_concurrently(self):
+        latency = 0.3
+        model = self.build_model(SlowGenerator(latency), max_concurrency=4)
+        prompts = ["a cat", "a dog", "a pharaoh", "a pyramid"]
+
+        start = time.perf_counter()
+        result = model.generate_images(prompts)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result, {p: p[::-1] for p in prompts})
+        self.assertLess(elapsed, latency * 2)
+
+    def test_generate_images_respects_max_concurrency(self):
+        latency = 0.2
+        model = self.build_model(SlowGenerator(latency), max_concurrency=2)
+
+        start = time.perf_counter()
+        result = model.generate_images(["a", "b", "c", "d"])
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(result), 4)
+        self.assertGreaterEqual(elapsed, latency * 2)
+
+    def test_generate_images_skips_failed_prompts(self):
+        model = self.build_model(
+            SlowGenerator(0.01, failing={"a dragon"}), retries=1, backoff=0
+        )
+
+        result = model.generate_images(["a cat", "a dragon"])
+
+        self.assertEqual(result, {"a cat": "tac a"})
+
+    def test_generate_images_retries_with_backoff(self):
+        generator = SlowGenerator(0.01, flaky=2)
+        model = self.build_model(generator, max_concurrency=1, retries=2, backoff=0)
+
+        result = model.generate_images(["a cat"])
+
+        self.assertEqual(result, {"a cat": "tac a"})
+        self.assertEqual(generator.calls, 3)
+
+    def test_requests_time_out_in_the_session(self):
+        model = NvidiaFoundationVisionModel(api_key="", timeout=0.05)
+
+        self.assertEqual(model._session.get_adapter("https://").timeout, 0.05)
+
+    def test_agenerate_images(self):
+        latency = 0.3
+        model = self.build_model(SlowGenerator(latency), max_concurrency=3)
+        prompts = ["a cat", "a dog", "a cat", "a pyramid"]
+
+        start = time.perf_counter()
+        result = asyncio.run(model.agenerate_images(prompts))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(set(result), {"a cat", "a dog", "a pyramid"})
+        self.assertLess(elapsed, latency * 2)
+
+    def test_generate_images_uses_image_cache(self):
+        generator = SlowGenerator(0.01, failing={"a dragon"})
+        model = self.build_model(generator, retries=0, cache=Cache(path=":memory:"))
+
+        model.generate_images(["a cat", "a dragon"])
+        result = model.generate_images(["a cat", "a dragon"])
+
+        self.assertEqual(result, {"a cat": "tac a"})
+        self.assertEqual(generator.calls, 3)
+        self.assertEqual(model.cache.stats()["image"]["hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
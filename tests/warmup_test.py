@@ -0,0 +1,60 @@
+import subprocess
+import sys
+import unittest
+from unittest.mock import MagicMock
+
+from app.warmup import warm_up
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_warm_up_loads_modules_encodings_and_clients(self):
+        llm = MagicMock()
+        vision_model = MagicMock()
+
+        timings = warm_up(
+            model_names=["meta/llama3-70b-instruct", "gpt-4"],
+            llm=llm,
+            vision_model=vision_model,
+            modules=["json"],
+        )
+
+        self.assertEqual(
+            list(timings),
+            [
+                "import json",
+                "encoding cl100k_base",
+                "client meta/llama3-70b-instruct",
+                "client gpt-4",
+                "vision client",
+            ],
+        )
+        self.assertEqual(llm.warm_up.call_count, 2)
+        vision_model.warm_up.assert_called_once_with()
+
+    def test_failed_steps_do_not_stop_the_warm_up(self):
+        llm = MagicMock()
+        llm.warm_up.side_effect = ConnectionError("unavailable")
+
+        timings = warm_up(
+            model_names=["llama3"], llm=llm, modules=["not_a_module", "json"]
+        )
+
+        self.assertIn("import json", timings)
+        self.assertIn("client llama3", timings)
+
+    def test_backends_are_imported_lazily(self):
+        code = (
+            "import sys, app.services.storyteller, app.services.image_store;"
+            "print(sorted(m for m in sys.modules if m.split('.')[0] in "
+            "('langchain_nvidia_ai_endpoints', 'langchain_community', "
+            "'langchain_text_splitters', 'unstructured', 'markdown', 'PIL')))"
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+
+        self.assertEqual(process.stdout.strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()